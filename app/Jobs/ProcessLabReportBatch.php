@@ -11,6 +11,8 @@
 use Illuminate\Queue\SerializesModels;
 use Illuminate\Support\Facades\Log;
 use Illuminate\Support\Facades\Storage;
+use Symfony\Component\Process\Exception\ProcessFailedException;
+use Symfony\Component\Process\Exception\ProcessTimedOutException;
 use Symfony\Component\Process\Process;
 
 class ProcessLabReportBatch implements ShouldQueue
@@ -42,6 +44,10 @@ public function handle()
             // Use optimized parallel processing with Python script
             $this->processWithPythonScript();
 
+        } catch (ProcessTimedOutException $e) {
+            // The batch status already reflects the results streamed before the
+            // timeout; re-throw so the job is retried without overwriting it.
+            throw $e;
         } catch (\Exception $e) {
             $this->reportBatch->update([
                 'status' => 'failed',
@@ -86,9 +92,15 @@ private function processWithPythonScript()
             '--workers',
             (string) $workerCount,
             '--output-format',
-            'json'
+            'ndjson'
         ];
 
+        // A retried job replays files the previous attempt already finished
+        // from the checkpoint manifest and only processes the remainder.
+        if ($this->attempts() > 1) {
+            $command[] = '--resume';
+        }
+
         Log::info('Starting parallel OCR processing', [
             'batch_id' => $this->reportBatch->id,
             'command' => implode(' ', $command),
@@ -100,37 +112,86 @@ private function processWithPythonScript()
         $process = new Process($command);
         $process->setTimeout(1200); // 20 minutes for large batches
         $process->setIdleTimeout(300); // 5 minutes idle timeout
+        $process->start();
 
-        $process->mustRun();
-        $output = $process->getOutput();
-        
-        if (empty($output)) {
-            throw new \Exception('No output received from OCR script');
+        // The script streams one JSON result per line as each file completes,
+        // so lab reports are updated as soon as their result arrives.
+        $buffer = '';
+        $resultsCount = 0;
+
+        try {
+            foreach ($process->getIterator(Process::ITER_SKIP_ERR) as $chunk) {
+                $buffer .= $chunk;
+                $process->clearOutput();
+
+                while (($newline = strpos($buffer, "\n")) !== false) {
+                    $resultsCount += $this->handleResultLine(substr($buffer, 0, $newline));
+                    $buffer = substr($buffer, $newline + 1);
+                }
+            }
+            $resultsCount += $this->handleResultLine($buffer);
+        } catch (ProcessTimedOutException $e) {
+            Log::error('OCR processing timed out, keeping completed results', [
+                'batch_id' => $this->reportBatch->id,
+                'results_count' => $resultsCount
+            ]);
+            $this->updateFinalBatchStatus();
+            throw $e;
         }
 
-        $results = json_decode($output, true);
-        
-        if (json_last_error() !== JSON_ERROR_NONE) {
-            Log::error('Invalid JSON output from Python script', [
+        if (!$process->isSuccessful()) {
+            Log::error('OCR script exited with an error', [
                 'batch_id' => $this->reportBatch->id,
-                'json_error' => json_last_error_msg(),
-                'output_preview' => substr($output, 0, 500)
+                'exit_code' => $process->getExitCode(),
+                'results_count' => $resultsCount,
+                'error_output' => substr($process->getErrorOutput(), -2000)
             ]);
-            throw new \Exception('Invalid JSON output: ' . json_last_error_msg());
+
+            if ($resultsCount === 0) {
+                throw new ProcessFailedException($process);
+            }
+        }
+
+        if ($resultsCount === 0) {
+            throw new \Exception('No output received from OCR script');
         }
 
         Log::info('OCR processing completed', [
             'batch_id' => $this->reportBatch->id,
-            'results_count' => count($results)
+            'results_count' => $resultsCount
         ]);
 
-        // Process results and update database
-        $this->updateLabReportsFromResults($results);
-
         // Update final batch status
         $this->updateFinalBatchStatus();
     }
 
+    /**
+     * Decode one NDJSON result line and apply it. Returns the number of results handled.
+     */
+    private function handleResultLine(string $line): int
+    {
+        $line = trim($line);
+
+        if ($line === '') {
+            return 0;
+        }
+
+        $result = json_decode($line, true);
+
+        if (json_last_error() !== JSON_ERROR_NONE || !is_array($result)) {
+            Log::error('Invalid JSON line from Python script', [
+                'batch_id' => $this->reportBatch->id,
+                'json_error' => json_last_error_msg(),
+                'output_preview' => substr($line, 0, 500)
+            ]);
+            return 0;
+        }
+
+        $this->updateLabReportsFromResults([$result]);
+
+        return 1;
+    }
+
     /**
      * Update lab reports from Python script results.
      */
@@ -0,0 +1,124 @@
+import json
+import argparse
+import collections
+import concurrent.futures
+import random
+import signal
+import threading
+import time
+import os
+from typing import Dict, List, Optional
+
+import grpc
+from google.cloud import documentai
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_TEXT = os.path.join(SCRIPTS_DIR, 'test_ocr.txt')
+PROCESS_DOCUMENT_METHOD = 'ProcessDocument'
+SERVICE_NAME = 'google.cloud.documentai.v1.DocumentProcessorService'
+
+class FakeDocumentAi:
+    def __init__(self, texts: List[str], latency_ms: float, latency_sigma: float, tail_rate: float, tail_ms: float,
+                 exhausted_rate: float, quota_rpm: Optional[float], seed: Optional[int] = None):
+        self.texts = texts
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.tail_rate = tail_rate
+        self.tail_ms = tail_ms
+        self.exhausted_rate = exhausted_rate
+        self.quota_rpm = quota_rpm
+        self.stats = collections.Counter()
+        self.latencies = []
+        self._recent = collections.deque()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _draw(self) -> Dict[str, float]:
+        with self._lock:
+            self.stats['requests'] += 1
+            now = time.monotonic()
+            while self._recent and now - self._recent[0] > 60:
+                self._recent.popleft()
+            over_quota = self.quota_rpm is not None and len(self._recent) >= self.quota_rpm
+            if not over_quota:
+                self._recent.append(now)
+            exhausted = over_quota or self._random.random() < self.exhausted_rate
+            latency = self.latency_ms * (self._random.lognormvariate(0, self.latency_sigma) if self.latency_sigma else 1)
+            if self._random.random() < self.tail_rate:
+                latency += self.tail_ms
+            text = self.texts[self.stats['requests'] % len(self.texts)]
+        return {'exhausted': exhausted, 'latency': latency / 1000, 'text': text}
+
+    def process_document(self, request: documentai.ProcessRequest, context: grpc.ServicerContext) -> documentai.ProcessResponse:
+        draw = self._draw()
+        if draw['exhausted']:
+            with self._lock:
+                self.stats['resource_exhausted'] += 1
+            context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, 'Quota exceeded for fake Document AI')
+        time.sleep(draw['latency'])
+        with self._lock:
+            self.stats['ok'] += 1
+            self.stats['bytes_in'] += len(request.raw_document.content)
+            self.latencies.append(draw['latency'])
+        return documentai.ProcessResponse(document=documentai.Document(text=draw['text']))
+
+    def summary(self) -> Dict[str, float]:
+        with self._lock:
+            latencies = sorted(self.latencies)
+            summary = dict(self.stats)
+        if latencies:
+            summary['p50_ms'] = round(latencies[len(latencies) // 2] * 1000, 1)
+            summary['p99_ms'] = round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 1)
+        return summary
+
+def create_server(fake: FakeDocumentAi, port: int, max_workers: int):
+    handler = grpc.method_handlers_generic_handler(SERVICE_NAME, {
+        PROCESS_DOCUMENT_METHOD: grpc.unary_unary_rpc_method_handler(
+            fake.process_document,
+            request_deserializer=documentai.ProcessRequest.deserialize,
+            response_serializer=documentai.ProcessResponse.serialize
+        )
+    })
+    server = grpc.server(concurrent.futures.ThreadPoolExecutor(max_workers=max_workers))
+    server.add_generic_rpc_handlers((handler,))
+    bound_port = server.add_insecure_port(f'127.0.0.1:{port}')
+    return server, bound_port
+
+def load_texts(paths: List[str]) -> List[str]:
+    texts = []
+    for path in paths:
+        files = [os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith('.txt')] if os.path.isdir(path) else [path]
+        for file_path in files:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                texts.append(f.read())
+    return texts
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the Document AI ProcessDocument endpoint')
+    parser.add_argument('--port', type=int, default=8085, help='Port to listen on (0 picks a free port)')
+    parser.add_argument('--text', action='append', help='Canned OCR text file or directory of .txt files, cycled per request (repeatable)')
+    parser.add_argument('--latency-ms', type=float, default=800, help='Median response latency')
+    parser.add_argument('--latency-sigma', type=float, default=0.4, help='Log-normal spread of the latency (0 = fixed)')
+    parser.add_argument('--tail-rate', type=float, default=0.0, help='Fraction of requests that get --tail-ms extra latency')
+    parser.add_argument('--tail-ms', type=float, default=5000, help='Extra latency for tail requests')
+    parser.add_argument('--exhausted-rate', type=float, default=0.0, help='Fraction of requests rejected with RESOURCE_EXHAUSTED')
+    parser.add_argument('--quota-rpm', type=float, default=None, help='Reject requests beyond this many per rolling minute with RESOURCE_EXHAUSTED')
+    parser.add_argument('--max-workers', type=int, default=64, help='Concurrent requests served')
+    parser.add_argument('--seed', type=int, default=None, help='Random seed for latency and error draws')
+    args = parser.parse_args()
+
+    fake = FakeDocumentAi(load_texts(args.text or [DEFAULT_TEXT]), args.latency_ms, args.latency_sigma, args.tail_rate,
+                          args.tail_ms, args.exhausted_rate, args.quota_rpm, args.seed)
+    server, port = create_server(fake, args.port, args.max_workers)
+    server.start()
+    # The first stdout line tells a parent process (load_test.py) where to connect.
+    print(json.dumps({'listening': f'127.0.0.1:{port}'}), flush=True)
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopped.set())
+    signal.signal(signal.SIGINT, lambda *_: stopped.set())
+    stopped.wait()
+    server.stop(grace=1)
+    print(json.dumps({'summary': fake.summary()}), flush=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+import sys
+import json
+import argparse
+import collections
+import subprocess
+import tempfile
+import time
+import os
+from typing import Any, Dict, List, Optional
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+DOCUMENT_OCR = os.path.join(SCRIPTS_DIR, 'document_ocr.py')
+FAKE_SERVER = os.path.join(BENCHMARKS_DIR, 'fake_document_ai.py')
+
+def minimal_pdf(index: int) -> bytes:
+    # One blank page; the comment makes every file's bytes (and so its cache key) unique.
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] >>',
+    ]
+    body = b'%PDF-1.4\n%load-test ' + str(index).encode() + b'\n'
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(body))
+        body += f'{number} 0 obj\n'.encode() + obj + b'\nendobj\n'
+    xref = len(body)
+    body += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode()
+    body += b''.join(f'{offset:010d} 00000 n \n'.encode() for offset in offsets)
+    body += f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode()
+    return body
+
+def write_workload(directory: str, files: int) -> List[str]:
+    paths = []
+    for index in range(files):
+        path = os.path.join(directory, f'report_{index:05d}.pdf')
+        with open(path, 'wb') as f:
+            f.write(minimal_pdf(index))
+        paths.append(path)
+    return paths
+
+def start_fake_server(server_args: List[str]) -> subprocess.Popen:
+    process = subprocess.Popen([sys.executable, FAKE_SERVER, '--port', '0'] + server_args, stdout=subprocess.PIPE, text=True)
+    process.endpoint = json.loads(process.stdout.readline())['listening']
+    return process
+
+def stop_fake_server(process: subprocess.Popen) -> Dict[str, Any]:
+    process.terminate()
+    output, _ = process.communicate(timeout=30)
+    for line in output.splitlines():
+        if line.startswith('{"summary"'):
+            return json.loads(line)['summary']
+    return {}
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {'p50': None, 'p90': None, 'p99': None, 'max': None}
+    values = sorted(values)
+    pick = lambda percent: round(values[min(len(values) - 1, int(len(values) * percent / 100))], 1)
+    return {'p50': pick(50), 'p90': pick(90), 'p99': pick(99), 'max': round(values[-1], 1)}
+
+def run_workload(mode: str, workload_dir: str, file_paths: List[str], endpoint: str, ocr_args: List[str]) -> Dict[str, Any]:
+    if mode == 'batch':
+        target = ['--batch', workload_dir]
+    else:
+        list_path = os.path.join(workload_dir, 'files.lst')
+        with open(list_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(file_paths) + '\n')
+        target = ['--file-list', list_path]
+    command = [sys.executable, DOCUMENT_OCR] + target + ['--output-format', 'ndjson', '--no-cache', '--no-checkpoint', '--document-ai-endpoint', endpoint] + ocr_args
+    start_time = time.perf_counter()
+    completed = subprocess.run(command, cwd=workload_dir, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    wall = time.perf_counter() - start_time
+    results = [json.loads(line) for line in completed.stdout.splitlines() if line.strip()]
+    counters = collections.Counter()
+    backends = collections.Counter()
+    for result in results:
+        counters.update(result.get('metrics', {}).get('counters', {}))
+        backends[result.get('ocrBackend') or ('error' if not result.get('success') else 'none')] += 1
+    return {
+        'mode': mode,
+        'exit_code': completed.returncode,
+        'files': len(results),
+        'errors': sum(1 for result in results if not result.get('success')),
+        'wall_s': round(wall, 3),
+        'files_per_s': round(len(results) / wall, 2) if wall else None,
+        'file_latency_ms': percentiles([result['metrics']['totalMs'] for result in results if 'metrics' in result]),
+        'document_ai_ms': percentiles([result['metrics']['stagesMs']['document_ai'] for result in results
+                                       if 'document_ai' in result.get('metrics', {}).get('stagesMs', {})]),
+        'counters': dict(counters),
+        'backends': dict(backends)
+    }
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f'{report["mode"]}: {report["files"]} files in {report["wall_s"]:.2f}s ({report["files_per_s"]} files/s), '
+          f'{report["errors"]} errors, exit {report["exit_code"]}')
+    for name in ('file_latency_ms', 'document_ai_ms'):
+        stats = report[name]
+        print(f'  {name:<16}' + '  '.join(f'{key}={value}' for key, value in stats.items()))
+    print(f'  backends        {report["backends"]}')
+    print(f'  counters        {report["counters"]}')
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run document_ocr.py workloads against the fake Document AI server',
+        epilog='Arguments after -- are passed to document_ocr.py, e.g. -- --engine async --rpm 300'
+    )
+    parser.add_argument('--files', type=int, default=100, help='PDFs in the generated workload')
+    parser.add_argument('--mode', choices=['batch', 'file-list', 'both'], default='both', help='Input style to exercise')
+    parser.add_argument('--endpoint', help='Use an already running server instead of starting fake_document_ai.py')
+    parser.add_argument('--server-arg', action='append', default=[], help='Extra fake_document_ai.py argument, e.g. --server-arg=--exhausted-rate=0.05 (repeatable)')
+    parser.add_argument('--json', action='store_true', help='Print machine-readable results')
+    args, ocr_args = parser.parse_known_args()
+    ocr_args = [arg for arg in ocr_args if arg != '--']
+
+    server = None if args.endpoint else start_fake_server(args.server_arg)
+    endpoint = args.endpoint or server.endpoint
+    reports = []
+    try:
+        with tempfile.TemporaryDirectory(prefix='clinex_load_') as workload_dir:
+            file_paths = write_workload(workload_dir, args.files)
+            for mode in (['batch', 'file-list'] if args.mode == 'both' else [args.mode]):
+                reports.append(run_workload(mode, workload_dir, file_paths, endpoint, ocr_args))
+    finally:
+        server_summary = stop_fake_server(server) if server else {}
+    if args.json:
+        print(json.dumps({'runs': reports, 'server': server_summary}, indent=2))
+        return
+    for report in reports:
+        print_report(report)
+    if server_summary:
+        print(f'server: {server_summary}')
+
+if __name__ == '__main__':
+    main()
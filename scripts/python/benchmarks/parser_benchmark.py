@@ -0,0 +1,246 @@
+import sys
+import json
+import argparse
+import random
+import re
+import time
+import os
+from typing import Any, Callable, Dict, List, Tuple
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'parser_baseline.json')
+sys.path.insert(0, SCRIPTS_DIR)
+
+import document_ocr
+
+CATEGORY_TESTS = {
+    'HEMATOLOGY': ['WBC', 'LYM%', 'MONO%', 'NUE%', 'EOSINO%', 'BASO%', 'HGB', 'RBC', 'MCV', 'MCH', 'MCHC'],
+    'BIOCHIMISTRY': ['Glucose', 'Creatinine, serum', 'Urea/BUN', 'Cholesterole Total', 'Cholesterol-HDL', 'Cholesterol-LDL',
+                     'Tryglyceride', 'Uric acide', 'SGPT/ALT', 'SGOT/AST', 'GGT (Gamm Glutamyl Transferas)'],
+    'URINE ANALYSIS': ['LEU', 'NIT', 'URO', 'PRO', 'PH', 'BLO', 'SG', 'KET', 'BIL', 'GLU', 'ASC'],
+    'DRUG URINE': ['Morphine', 'Amphetamine', 'Metamphetamine'],
+}
+STAGES = ['_preprocess_lines', '_extract_pairs_optimized', '_apply_corrections_optimized', 'parse_test_results']
+
+HOSPITAL_HEADERS = ['មន្ទីរពេទ្យ ខវី', 'មន្ទីរពិសោធន៍វេជ្ជសាស្ត្រ', 'CLINEX MEDICAL LABORATORY', 'Khmer-Soviet Friendship Hospital']
+NOISE_LINES = ['LABORATORY REPORT', 'លទ្ធផលពិសោធន៍', 'Page 1 of 1', 'Test Result Unit Reference Range',
+               'ឈ្មោះតេស្ត លទ្ធផល ឯកតា', '*** END OF REPORT ***', 'Printed by: system', '-----------------------']
+FAMILY_NAMES = ['SOK', 'CHAN', 'KIM', 'HIM', 'LEANG', 'CHHORN', 'SUN', 'KEO', 'PICH', 'MEAS']
+GIVEN_NAMES = ['DARA', 'SOPHY', 'TULOH', 'SOVANN', 'CHOEU', 'SOPHEA', 'VUTHY', 'BOPHA', 'RITHY', 'NARY']
+NEGATIVE_RESULTS = ['NEGATIVE', 'NEGATIVE', 'NEGATIVE', 'POSITIVE']
+
+def _header_fields(rng: random.Random, index: int) -> List[Tuple[str, str]]:
+    day, hour = rng.randint(1, 28), rng.randint(7, 20)
+    requested = f'{day:02d}/{rng.randint(1, 12):02d}/2024 {hour:02d}:{rng.randint(0, 59):02d}'
+    return [
+        (rng.choice(['ឈ្មោះ/Name', 'ឈោ្មះ/Name', 'Name']), f'{rng.choice(FAMILY_NAMES)} {rng.choice(GIVEN_NAMES)}'),
+        ('Patient ID', f'PT{index % 1000000:06d}'),
+        (rng.choice(['អាយុ/Age', 'Age']), f'{rng.randint(1, 90)} Y, {rng.randint(0, 11)} M'),
+        (rng.choice(['ភេទ/Gender', 'Gender']), rng.choice(['Male', 'Female'])),
+        (rng.choice(['ទូរស័ព្ទ/Phone', 'លេខទូរស័ព្ទ']), f'0{rng.randint(10, 99)} {rng.randint(100, 999)} {rng.randint(100, 999)}'),
+        ('Lab ID', f'LT{index % 1000000:06d}'),
+        ('Requested By', f'Dr. {rng.choice(FAMILY_NAMES)} {rng.choice(GIVEN_NAMES).title()}'),
+        ('Requested Date', requested),
+        ('Collected Date', requested),
+        ('Analysis Date', requested),
+    ]
+
+def _result_value(rng: random.Random, entry: Dict[str, Any]) -> str:
+    default = entry.get('default') or '100'
+    try:
+        value = float(default)
+    except ValueError:
+        return rng.choice(NEGATIVE_RESULTS) if default == 'NEGATIVE' else default
+    decimals = len(default.split('.')[1]) if '.' in default else 0
+    return f'{value * rng.uniform(0.7, 1.3):.{decimals}f}'
+
+def _test_line(rng: random.Random, entry: Dict[str, Any]) -> str:
+    parts = [entry['name'], _result_value(rng, entry)]
+    if rng.random() < 0.15:
+        parts.append(rng.choice(['H', 'L']))
+    if entry.get('unit'):
+        parts.append(entry['unit'])
+    if entry.get('referenceRange'):
+        parts.append(entry['referenceRange'])
+    return ' '.join(parts)
+
+def generate_report(rng: random.Random, index: int, catalog: document_ocr.LabTestCatalog) -> Tuple[str, Dict[str, Any]]:
+    lines = [rng.choice(HOSPITAL_HEADERS), f'Tel: 0{rng.randint(10, 99)} {rng.randint(100, 999)} {rng.randint(10, 99)} {rng.randint(10, 99)}']
+    fields = _header_fields(rng, index)
+    inline = rng.random() < 0.5
+    for key, value in fields:
+        if inline:
+            lines.append(f'{key} : {value}')
+        else:
+            lines.extend([key, f': {value}'])
+        if rng.random() < 0.1:
+            lines.append(lines[-1])
+    lines.append(rng.choice(NOISE_LINES))
+    test_count = 0
+    categories = rng.sample(list(CATEGORY_TESTS), rng.randint(1, len(CATEGORY_TESTS)))
+    for category in categories:
+        lines.append(category)
+        names = CATEGORY_TESTS[category]
+        for name in rng.sample(names, rng.randint(max(1, len(names) // 3), len(names))):
+            lines.append(_test_line(rng, catalog.lookup(name)))
+            test_count += 1
+            if rng.random() < 0.05:
+                lines.append(lines[-1])
+        for _ in range(rng.randint(0, 2)):
+            lines.append(rng.choice(NOISE_LINES))
+    lines.append(f'Lab Technician : {rng.choice(["ស៊ុន សុភា", "កែវ បុប្ផា", "ម៉ាស់ រិទ្ធី"])}')
+    expected = {'patientId': fields[1][1], 'labId': fields[5][1], 'testCount': test_count}
+    return '\n'.join(lines) + '\n', expected
+
+def generate_corpus(count: int, seed: int) -> List[Tuple[str, Dict[str, Any]]]:
+    rng = random.Random(seed)
+    catalog = document_ocr.load_test_catalog()
+    return [generate_report(rng, index, catalog) for index in range(count)]
+
+def _timed(timings: Dict[str, float], stage: str, func: Callable, *args):
+    start_time = time.perf_counter()
+    result = func(*args)
+    timings[stage] += time.perf_counter() - start_time
+    return result
+
+def run_once(parser: document_ocr.OptimizedLabReportParser, corpus: List[Tuple[str, Dict[str, Any]]]) -> Dict[str, Any]:
+    stage_totals = dict.fromkeys(STAGES, 0.0)
+    for text, _ in corpus:
+        lines, kinds = _timed(stage_totals, '_preprocess_lines', parser._scan_lines, text)
+        field_map = _timed(stage_totals, '_extract_pairs_optimized', parser._extract_pairs_optimized, lines, kinds)
+        _timed(stage_totals, '_apply_corrections_optimized', parser._apply_corrections_optimized, field_map, lines)
+        _timed(stage_totals, 'parse_test_results', parser.parse_test_results, lines)
+    correct = 0
+    start_time = time.perf_counter()
+    for text, expected in corpus:
+        parsed = parser.parse_optimized(text)
+        correct += (parsed['patientInfo']['patientId'] == expected['patientId']
+                    and parsed['labInfo']['labId'] == expected['labId']
+                    and len(parsed['testResults']) == expected['testCount'])
+    elapsed = time.perf_counter() - start_time
+    return {
+        'reports_per_sec': len(corpus) / elapsed,
+        'stage_us_per_report': {stage: total / len(corpus) * 1e6 for stage, total in stage_totals.items()},
+        'accuracy': correct / len(corpus)
+    }
+
+CALIBRATION_PATTERNS = [re.compile(pattern, re.MULTILINE) for pattern in (r'^(\S+)\s*:\s*(.+)$', r'(\d+\.?\d*)\s*(\S*)\s*\(([^)]*)\)', r'^[A-Z][A-Z ]+$')]
+
+def calibrate(texts: List[str]) -> float:
+    # A fixed regex/dict/string workload over the same corpus text, timed in this process. The gate
+    # compares parser timings as multiples of it, so a slower or busier machine does not read as a regression.
+    start_time = time.perf_counter()
+    for text in texts:
+        lines = [line.strip() for line in text.split('\n')]
+        fields = {}
+        for pattern in CALIBRATION_PATTERNS:
+            for match in pattern.finditer(text):
+                fields[match.group(0).upper()] = match.groups()
+        ' '.join(sorted(fields)) + ''.join(lines)
+    return (time.perf_counter() - start_time) / len(texts) * 1e6
+
+def run_benchmark(reports: int, seed: int, repeats: int) -> Dict[str, Any]:
+    corpus = generate_corpus(reports, seed)
+    parser = document_ocr.OptimizedLabReportParser()
+    parser.parse_optimized(corpus[0][0])
+    calibration_texts = [text for text, _ in corpus[:200]]
+    runs = []
+    for _ in range(repeats):
+        # Calibrate right around each pass, so a machine whose speed drifts is compared with itself.
+        before = min(calibrate(calibration_texts) for _ in range(3))
+        run = run_once(parser, corpus)
+        run['calibration_us'] = min([before] + [calibrate(calibration_texts) for _ in range(3)])
+        runs.append(run)
+    # Best-of-N everywhere: noise only ever adds time.
+    return {
+        'reports': reports,
+        'seed': seed,
+        'repeats': repeats,
+        'reports_per_sec': round(max(run['reports_per_sec'] for run in runs), 1),
+        'stage_us_per_report': {stage: round(min(run['stage_us_per_report'][stage] for run in runs), 2) for stage in STAGES},
+        'accuracy': round(min(run['accuracy'] for run in runs), 4),
+        'calibration_us': round(min(run['calibration_us'] for run in runs), 2),
+        'relative': {
+            'reports_per_calibration': round(max(run['reports_per_sec'] * run['calibration_us'] / 1e6 for run in runs), 4),
+            'stage_calibrations_per_report': {
+                stage: round(min(run['stage_us_per_report'][stage] / run['calibration_us'] for run in runs), 5) for stage in STAGES
+            }
+        }
+    }
+
+def compare_to_baseline(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    regressions = []
+    current, previous = results['relative'], baseline['relative']
+    if current['reports_per_calibration'] < previous['reports_per_calibration'] * (1 - tolerance):
+        regressions.append(f'throughput {current["reports_per_calibration"]:.4f} reports/calibration < baseline {previous["reports_per_calibration"]:.4f} '
+                           f'({results["reports_per_sec"]:.1f} reports/s)')
+    for stage in STAGES:
+        now, before = current['stage_calibrations_per_report'][stage], previous['stage_calibrations_per_report'][stage]
+        if now > before * (1 + tolerance):
+            regressions.append(f'{stage} {now:.5f} calibrations/report > baseline {before:.5f} '
+                               f'({results["stage_us_per_report"][stage]:.1f}us/report)')
+    if results['accuracy'] < baseline['accuracy']:
+        regressions.append(f'accuracy {results["accuracy"]:.4f} < baseline {baseline["accuracy"]:.4f}')
+    return regressions
+
+def write_corpus(corpus: List[Tuple[str, Dict[str, Any]]], directory: str) -> None:
+    os.makedirs(directory, exist_ok=True)
+    for index, (text, _) in enumerate(corpus):
+        with open(os.path.join(directory, f'report_{index:06d}.txt'), 'w', encoding='utf-8') as f:
+            f.write(text)
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure OptimizedLabReportParser throughput on a synthetic OCR corpus')
+    parser.add_argument('--reports', type=int, default=2000, help='Synthetic reports in the corpus')
+    parser.add_argument('--seed', type=int, default=1234, help='Corpus random seed')
+    parser.add_argument('--repeats', type=int, default=5, help='Timed passes over the corpus')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Baseline JSON to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='Store these results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed slowdown before failing (0.25 = 25%%)')
+    parser.add_argument('--write-corpus', metavar='DIR', help='Write the generated corpus as .txt files and exit')
+    parser.add_argument('--json', action='store_true', help='Print machine-readable results')
+    args = parser.parse_args()
+
+    if args.write_corpus:
+        write_corpus(generate_corpus(args.reports, args.seed), args.write_corpus)
+        print(f'Wrote {args.reports} reports to {args.write_corpus}')
+        return
+
+    results = run_benchmark(args.reports, args.seed, args.repeats)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f'{results["reports_per_sec"]:.1f} reports/s over {results["reports"]} reports, accuracy {results["accuracy"]:.2%}')
+        for stage, micros in results['stage_us_per_report'].items():
+            print(f'  {stage:<32}{micros:>10.1f}us/report')
+        print(f'  {"calibration loop":<32}{results["calibration_us"]:>10.1f}us/report')
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+            f.write('\n')
+        print(f'Baseline saved to {args.baseline}', file=sys.stderr)
+        return
+    if not os.path.exists(args.baseline):
+        print(f'No baseline at {args.baseline}; run with --save-baseline first', file=sys.stderr)
+        return
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    if 'relative' not in baseline:
+        print(f'Baseline at {args.baseline} has no calibrated timings; rerun with --save-baseline', file=sys.stderr)
+        sys.exit(2)
+    if (baseline['reports'], baseline['seed']) != (results['reports'], results['seed']):
+        print('Baseline was recorded with a different corpus; rerun with matching --reports/--seed', file=sys.stderr)
+        sys.exit(2)
+    regressions = compare_to_baseline(results, baseline, args.tolerance)
+    if regressions:
+        # A real slowdown survives a second measurement; a noisy neighbour usually does not.
+        print(f'Possible regression ({len(regressions)} figures), measuring again', file=sys.stderr)
+        regressions = compare_to_baseline(run_benchmark(args.reports, args.seed, args.repeats), baseline, args.tolerance)
+    for regression in regressions:
+        print(f'REGRESSION: {regression}', file=sys.stderr)
+    if regressions:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+import time
+import os
+from typing import Dict, List
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DOCUMENT_OCR = os.path.join(SCRIPTS_DIR, 'document_ocr.py')
+DEFAULT_SAMPLE = os.path.join(SCRIPTS_DIR, 'test_ocr.txt')
+
+def time_command(command: List[str], runs: int) -> List[float]:
+    timings = []
+    for _ in range(runs):
+        start_time = time.perf_counter()
+        subprocess.run(command, cwd=SCRIPTS_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        timings.append(time.perf_counter() - start_time)
+    return timings
+
+def summarize(timings: List[float]) -> Dict[str, float]:
+    return {
+        'min_ms': round(min(timings) * 1000, 1),
+        'median_ms': round(statistics.median(timings) * 1000, 1),
+        'max_ms': round(max(timings) * 1000, 1)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure cold-start time of document_ocr.py')
+    parser.add_argument('--runs', type=int, default=10, help='Runs per measurement')
+    parser.add_argument('--python', default=sys.executable, help='Interpreter to benchmark')
+    parser.add_argument('--sample', default=DEFAULT_SAMPLE, help='OCR text file used for the end-to-end run')
+    parser.add_argument('--json', action='store_true', help='Print machine-readable results')
+    args = parser.parse_args()
+    measurements = {
+        'interpreter': [args.python, '-c', 'pass'],
+        'import document_ocr': [args.python, '-c', 'import document_ocr'],
+        'parse --file (txt)': [args.python, DOCUMENT_OCR, '--file', args.sample, '--no-cache'],
+    }
+    results = {name: summarize(time_command(command, args.runs)) for name, command in measurements.items()}
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f'{"measurement":<24}{"min":>10}{"median":>10}{"max":>10}')
+    for name, summary in results.items():
+        print(f'{name:<24}{summary["min_ms"]:>8.1f}ms{summary["median_ms"]:>8.1f}ms{summary["max_ms"]:>8.1f}ms')
+
+if __name__ == '__main__':
+    main()
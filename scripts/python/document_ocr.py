@@ -1,20 +1,175 @@
 import sys
+import io
 import json
 import re
 import argparse
+import bisect
+import itertools
+import fnmatch
+import hashlib
+import tempfile
 import concurrent.futures
-from typing import Dict, Any, Optional, List
+import queue
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, List, Tuple, Iterable, Iterator
 from pathlib import Path
 import time
 import os
+import stat
+import threading
+import contextvars
+import socketserver
 from time import sleep
-from google.cloud import documentai
-from google.oauth2 import service_account
-from google.api_core import exceptions
+import importlib
+import functools
+import math
+
+class LazyModule:
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr: str):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+# Only the code paths that need these modules pay for importing them.
+asyncio = LazyModule('asyncio')
+multiprocessing = LazyModule('multiprocessing')
+documentai = LazyModule('google.cloud.documentai')
+service_account = LazyModule('google.oauth2.service_account')
+exceptions = LazyModule('google.api_core.exceptions')
+grpc = LazyModule('grpc')
+retries = LazyModule('google.api_core.retry')
+
+def is_resource_exhausted(error: Exception) -> bool:
+    if isinstance(error, ImportError):
+        return False
+    return isinstance(error, exceptions.ResourceExhausted)
+
+DOCUMENT_AI_PROJECT_ID = 'clinex-application'
+DOCUMENT_AI_LOCATION = 'us'
+DOCUMENT_AI_PROCESSOR_ID = '7039da43cbe33faf'
+DOCUMENT_AI_PROCESSOR_VERSION = 'default'
+BASE_PATH = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+CREDENTIALS_PATH = os.path.join(BASE_PATH, 'storage', 'app', 'google', 'clinex-application-ea5913277c08.json')
+DOCUMENT_AI_SCOPES = ['https://www.googleapis.com/auth/cloud-platform']
+# Plaintext gRPC host:port of a stand-in server (e.g. benchmarks/fake_document_ai.py); unset means Google.
+DOCUMENT_AI_ENDPOINT = os.environ.get('DOCUMENT_AI_ENDPOINT')
+TEST_CATALOG_PATH = os.environ.get('CLINEX_TEST_CATALOG', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_catalog.json'))
+OCR_CACHE_DIR = os.path.join(BASE_PATH, 'storage', 'app', 'ocr_cache')
+OCR_CACHE_MAX_MB = 1024
+DOCUMENT_AI_REQUESTS_PER_MINUTE = 120
+
+LINE_FIELD_KEY = 1
+LINE_CATEGORY = 2
+LINE_HOSPITAL_PHONE = 4
+
+def build_alternation(words: List[str]) -> str:
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word.lower():
+            node = node.setdefault(char, {})
+        node[''] = {}
+    return _trie_to_regex(trie)
+
+def _trie_to_regex(node: Dict[str, Any]) -> str:
+    branches = [(r'\s*' if char == ' ' else re.escape(char)) + _trie_to_regex(child) for char, child in sorted(node.items()) if char]
+    if not branches:
+        return ''
+    body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+    if '' in node:
+        return body + '?' if len(branches) > 1 or len(branches[0]) == 1 else '(?:' + body + ')?'
+    return body
+
+REFERENCE_RANGE_PATTERN = re.compile(r'^(?:(?P<low>\d+\.?\d*)\s*-\s*(?P<high>\d+\.?\d*)|(?P<op>[<>]=?|≤|≥)\s*(?P<bound>\d+\.?\d*))$')
+NUMERIC_RESULT_PATTERN = re.compile(r'^\d+\.?\d*$')
+# Below this many rows the NumPy array setup costs more than a plain loop.
+NUMPY_MIN_ROWS = 256
+
+@functools.lru_cache(maxsize=1024)
+def parse_reference_range(reference_range: Optional[str]) -> Tuple[float, float, bool, bool]:
+    # (low, high, low is exclusive, high is exclusive); a missing bound is NaN.
+    nan = float('nan')
+    match = REFERENCE_RANGE_PATTERN.match(reference_range.strip('$() ')) if reference_range else None
+    if match is None:
+        return nan, nan, False, False
+    if match.group('low') is not None:
+        return float(match.group('low')), float(match.group('high')), False, False
+    bound, op = float(match.group('bound')), match.group('op')
+    if op in ('>', '>=', '≥'):
+        return bound, nan, op == '>', False
+    return nan, bound, False, op == '<'
+
+class LabTestCatalog:
+    def __init__(self, tests: List[Dict[str, Any]], units: List[str]):
+        self.tests = tests
+        self.units = units
+        self._by_key = {}
+        for entry in tests:
+            for name in [entry['name']] + entry.get('aliases', []):
+                self._by_key[self.key(name)] = entry
+        self.test_row_pattern = re.compile(
+            r'^(?P<test_name>' + build_alternation([name for entry in tests for name in [entry['name']] + entry.get('aliases', [])]) + r')\s*:?\s*'
+            r'(?P<result>\d+\.?\d*|NEGATIVE|POSITIVE)\s*'
+            r'(?P<flag>[HL])?\s*'
+            r'(?P<unit>(?:' + '|'.join(re.escape(unit) for unit in units) + r')?)?\s*'
+            r'(?P<reference_range>(?:\([^)]+\)|\$\([^)]+\)\$)?)?$',
+            re.MULTILINE | re.IGNORECASE
+        )
+
+        # Ranges are parsed once per catalog entry (or distinct OCR'd range) and referred to by index,
+        # so flagging a batch only gathers rows from this small table.
+        self.bounds_table = []
+        self._bounds_ids = {}
+        self._entry_bounds = {entry['name']: self._intern_bounds(entry['referenceRange']) for entry in tests if 'referenceRange' in entry}
+        self._bounds_lock = threading.Lock()
+
+    @staticmethod
+    def key(name: str) -> str:
+        return re.sub(r'\s+', '', name).upper()
+
+    def _intern_bounds(self, reference_range: Optional[str]) -> int:
+        bounds_id = self._bounds_ids.get(reference_range)
+        if bounds_id is None:
+            bounds_id = self._bounds_ids[reference_range] = len(self.bounds_table)
+            self.bounds_table.append(parse_reference_range(reference_range))
+        return bounds_id
+
+    def bounds_id(self, test_name: str, reference_range: Optional[str]) -> int:
+        bounds_id = self._entry_bounds.get(test_name)
+        if bounds_id is None:
+            bounds_id = self._bounds_ids.get(reference_range)
+        if bounds_id is None:
+            with self._bounds_lock:
+                bounds_id = self._intern_bounds(reference_range)
+        return bounds_id
+
+    def lookup(self, name: str) -> Optional[Dict[str, Any]]:
+        return self._by_key.get(self.key(name))
+
+    @classmethod
+    def from_file(cls, path: str) -> 'LabTestCatalog':
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data['tests'], data['units'])
+
+_test_catalogs = {}
+_test_catalogs_lock = threading.Lock()
+
+def load_test_catalog(path: str = TEST_CATALOG_PATH) -> LabTestCatalog:
+    with _test_catalogs_lock:
+        if path not in _test_catalogs:
+            _test_catalogs[path] = LabTestCatalog.from_file(path)
+        return _test_catalogs[path]
 
 class OptimizedLabReportParser:
-    def __init__(self):
-        self.failed_patterns = []
+    def __init__(self, test_catalog: Optional[LabTestCatalog] = None):
+        self._state = threading.local()
+        self.test_catalog = test_catalog or load_test_catalog()
         self.patient_fields = {
             'name': ['ឈោ្មះ/Name', 'in:/Name', 'nin:/Name'],
             'patient_id': ['Patient ID'],
@@ -31,6 +186,20 @@ class OptimizedLabReportParser:
             'validated_by': ['Lab Technician', 'Validated By']
         }
         self.all_field_keys = set(sum(self.patient_fields.values(), []) + sum(self.lab_fields.values(), []))
+        # Output names used by patientInfo/labInfo (and template zones) mapped to their label keys.
+        self.output_fields = {
+            'name': self.patient_fields['name'],
+            'patientId': self.patient_fields['patient_id'],
+            'age': self.patient_fields['age'],
+            'gender': self.patient_fields['gender'],
+            'phone': self.patient_fields['phone'],
+            'labId': self.lab_fields['lab_id'],
+            'requestedBy': self.lab_fields['requested_by'],
+            'requestedDate': self.lab_fields['requested_date'],
+            'collectedDate': self.lab_fields['collected_date'],
+            'analysisDate': self.lab_fields['analysis_date'],
+            'validatedBy': self.lab_fields['validated_by']
+        }
         self.compiled_patterns = {
             'name': re.compile(r'ឈោ្មះ/Name\s*:\s*([^\W\d_][^\n]*?)(?=\s*(?:Patient|អាយុ|Lab|\n|$))', re.UNICODE),
             'patient_id': re.compile(r'Patient ID\s*:\s*(PT\d+)'),
@@ -44,14 +213,7 @@ class OptimizedLabReportParser:
             'analysis_date': re.compile(r'Analysis Date\s*:\s*(\d{2}/\d{2}/\d{4}\s+\d{2}:\d{2})'),
             'validated_by': re.compile(r'(?:Lab Technician|Validated By)\s*:\s*.*?([\u1780-\u17FF\s]+)(?=\s*(?:202[34]|\n|$))', re.UNICODE),
             'category': re.compile(r'\b(BIOCH(?:I|E)MISTRY|ENZYMOLOGY|HEMATOLOGY|SERO\s*/?\s*IMMUNOLOGY|URINE\s*ANALYSIS|DRUG\s*URINE)\b', re.IGNORECASE),
-            'test_row': re.compile(
-                r'^(?P<test_name>(?:Creatinine,?\s*serum|Urea/BUN|Glucose|Cholesterole?\s*Total|Cholesterol-HDL|Cholesterol-LDL|Tryglyceride|Uric\s*acide|GGT\s*\(Gamm\s*Glutamyl\s*Transferas\)|SGPT/ALT|SGOT/AST|Morphine|Amphetamine|Metamphetamine|WBC|LYM%|MONO%|NUE%|EOSINO%|BASO%|HGB|MCH|MCHC|RBC|MCV|LEU|NIT|URO|PRO|PH|BLO|SG|KET|BIL|GLU|ASC))\s*:?\s*'
-                r'(?P<result>\d+\.?\d*|NEGATIVE|POSITIVE)\s*'
-                r'(?P<flag>[HL])?\s*'
-                r'(?P<unit>(?:mg/dL|U/L|%|\$U/L\$|g/dL|Leu/µL|Ery/pl|x1012/L|fl|\$10\^\{9\}/L\$|pg)?)?\s*'
-                r'(?P<reference_range>(?:\([^)]+\)|\$\([^)]+\)\$)?)?$',
-                re.MULTILINE | re.IGNORECASE
-            )
+            'test_row': self.test_catalog.test_row_pattern
         }
         self.hospital_phone_patterns = [
             '097 840 47 89',
@@ -59,11 +221,31 @@ class OptimizedLabReportParser:
             '012 28 60 70'
         ]
         self.excluded_test_names = {'HOSPITAL', 'Results', 'Unit', 'Reference Range', 'Flag', 'CBC', 'TRANSAMINASE', 'DRUG URINE', 'HEMATOLOGY', 'URINE ANALYSIS 11 TEST'}
+        self.header_categories = ['LABORATORY REPORT', 'BIOCHIMISTRY', 'ENZYMOLOGY', 'HEMATOLOGY', 'DRUG URINE', 'URINE ANALYSIS']
+        self.hospital_phone_pattern = re.compile(self._literal_alternation(self.hospital_phone_patterns))
+        self.line_scanner = re.compile(
+            '(?P<phone>' + self._literal_alternation(self.hospital_phone_patterns) + ')'
+            '|(?P<field>' + self._literal_alternation(self.all_field_keys) + ')'
+        )
+        # Matched against upper-cased text: an IGNORECASE alternation is several times slower in re.
+        self.category_scanner = re.compile(self._literal_alternation(self.header_categories))
+        self.line_kinds = {'field': LINE_FIELD_KEY, 'phone': LINE_HOSPITAL_PHONE}
+
+    @staticmethod
+    def _literal_alternation(words) -> str:
+        return '|'.join(re.escape(word) for word in sorted(words, key=len, reverse=True))
+
+    @property
+    def failed_patterns(self) -> List[str]:
+        if not hasattr(self._state, 'failed_patterns'):
+            self._state.failed_patterns = []
+        return self._state.failed_patterns
 
     def parse_optimized(self, ocr_text: str) -> Dict[str, Any]:
         start_time = time.time()
-        lines = self._preprocess_lines(ocr_text)
-        field_map = self._extract_pairs_optimized(lines)
+        self._state.failed_patterns = []
+        lines, kinds = self._scan_lines(ocr_text)
+        field_map = self._extract_pairs_optimized(lines, kinds)
         field_map = self._apply_corrections_optimized(field_map, lines)
         processing_time = time.time() - start_time
         return {
@@ -73,20 +255,49 @@ class OptimizedLabReportParser:
             "processingTime": processing_time
         }
 
-    def _preprocess_lines(self, ocr_text: str) -> List[str]:
-        lines = [line.strip() for line in ocr_text.split('\n') if line.strip()]
+    def _classify_line(self, line: str) -> int:
+        kinds = 0
+        for match in self.line_scanner.finditer(line):
+            kinds |= self.line_kinds[match.lastgroup]
+        if self.category_scanner.search(line.upper()):
+            kinds |= LINE_CATEGORY
+        return kinds
+
+    def _scan_lines(self, ocr_text: str) -> Tuple[List[str], List[int]]:
+        raw_lines = ocr_text.split('\n')
+        raw_kinds = [0] * len(raw_lines)
+        line_starts = list(itertools.accumulate((len(line) + 1 for line in raw_lines), initial=0))
+        for match in self.line_scanner.finditer(ocr_text):
+            raw_kinds[bisect.bisect_right(line_starts, match.start()) - 1] |= self.line_kinds[match.lastgroup]
+        upper_text = ocr_text.upper()
+        if len(upper_text) == len(ocr_text):
+            for match in self.category_scanner.finditer(upper_text):
+                raw_kinds[bisect.bisect_right(line_starts, match.start()) - 1] |= LINE_CATEGORY
+        else:
+            for index, line in enumerate(raw_lines):
+                if self.category_scanner.search(line.upper()):
+                    raw_kinds[index] |= LINE_CATEGORY
         cleaned_lines = []
+        line_kinds = []
         prev_line = ""
-        for line in lines:
-            if line != prev_line and not any(hp in line for hp in self.hospital_phone_patterns):
+        for line, kinds in zip(raw_lines, raw_kinds):
+            line = line.strip()
+            if line and line != prev_line and not kinds & LINE_HOSPITAL_PHONE:
                 cleaned_lines.append(line)
+                line_kinds.append(kinds)
                 prev_line = line
-        return cleaned_lines
+        return cleaned_lines, line_kinds
+
+    def _preprocess_lines(self, ocr_text: str) -> List[str]:
+        return self._scan_lines(ocr_text)[0]
 
-    def _extract_pairs_optimized(self, lines: List[str]) -> Dict[str, str]:
+    def _extract_pairs_optimized(self, lines: List[str], kinds: Optional[List[int]] = None) -> Dict[str, str]:
+        if kinds is None:
+            kinds = [self._classify_line(line) for line in lines]
         field_map = {}
-        header_start, header_end = self._find_header_boundaries(lines)
+        header_start, header_end = self._find_header_boundaries(lines, kinds)
         header_lines = lines[header_start:header_end]
+        header_kinds = kinds[header_start:header_end]
         processed_indices = set()
         for i, line in enumerate(header_lines):
             if i in processed_indices or not line:
@@ -99,26 +310,28 @@ class OptimizedLabReportParser:
                     processed_indices.add(i)
                     continue
             if line in self.all_field_keys:
-                value = self._find_value_fast(header_lines, i + 1, processed_indices)
+                value = self._find_value_fast(header_lines, i + 1, processed_indices, header_kinds)
                 if value and not self._is_hospital_phone_fast(line, value):
                     field_map[line] = value
                     processed_indices.add(i)
         return field_map
 
-    def _find_header_boundaries(self, lines: List[str]) -> tuple:
+    def _find_header_boundaries(self, lines: List[str], kinds: Optional[List[int]] = None) -> tuple:
+        if kinds is None:
+            kinds = [self._classify_line(line) for line in lines]
         header_start = 0
         header_end = len(lines)
-        for idx, line in enumerate(lines):
+        for idx, line_kinds in enumerate(kinds):
             if header_start == 0:
-                if any(key in line for key in self.all_field_keys):
+                if line_kinds & LINE_FIELD_KEY:
                     header_start = idx
                     break
-            if any(cat in line.upper() for cat in ['LABORATORY REPORT', 'BIOCHIMISTRY', 'ENZYMOLOGY', 'HEMATOLOGY', 'DRUG URINE', 'URINE ANALYSIS']):
+            if line_kinds & LINE_CATEGORY:
                 header_end = idx
                 break
         return header_start, header_end
 
-    def _find_value_fast(self, lines: List[str], start_idx: int, processed_indices: set) -> Optional[str]:
+    def _find_value_fast(self, lines: List[str], start_idx: int, processed_indices: set, kinds: Optional[List[int]] = None) -> Optional[str]:
         for j in range(start_idx, min(start_idx + 5, len(lines))):
             if j in processed_indices:
                 continue
@@ -128,7 +341,7 @@ class OptimizedLabReportParser:
             if line.startswith(':'):
                 processed_indices.add(j)
                 return line[1:].strip()
-            if any(key in line for key in self.all_field_keys):
+            if (kinds[j] if kinds is not None else self._classify_line(line)) & LINE_FIELD_KEY:
                 continue
             return line
         return None
@@ -136,7 +349,7 @@ class OptimizedLabReportParser:
     def _is_hospital_phone_fast(self, key: str, value: str) -> bool:
         if key not in ['ទូរស័ព្ទ/Phone', 'លេខទូរស័ព្ទ']:
             return False
-        return any(pattern in value for pattern in self.hospital_phone_patterns)
+        return self.hospital_phone_pattern.search(value) is not None
 
     def _apply_corrections_optimized(self, field_map: Dict[str, str], lines: List[str]) -> Dict[str, str]:
         corrected = field_map.copy()
@@ -163,7 +376,7 @@ class OptimizedLabReportParser:
                 else:
                     if field_type == 'phone':
                         phone = match.group(1)
-                        if phone and not any(hp in phone for hp in self.hospital_phone_patterns):
+                        if phone and not self.hospital_phone_pattern.search(phone):
                             corrected[field_keys[0]] = phone
                     else:
                         corrected[field_keys[0]] = match.group(1).strip() if match.groups() else match.group(0).strip()
@@ -179,177 +392,65 @@ class OptimizedLabReportParser:
         
         for i, (start, end, category) in enumerate(category_ranges[:-1]):
             if category:
-                current_category = category.upper().replace('BIOCHIMISTRY', 'BIOCHEMISTRY').replace('DRUG URINE', 'DRUG URINE').replace('URINE ANALYSIS', 'URINE ANALYSIS')
+                current_category = self.normalize_category(category)
                 section_text = full_text[start:category_ranges[i+1][0]]
                 matches = self.compiled_patterns['test_row'].finditer(section_text)
                 for match in matches:
-                    test_name = match.group('test_name').strip()
-                    if test_name in self.excluded_test_names:
+                    entry = self.test_catalog.lookup(match.group('test_name'))
+                    if entry is None or entry['name'] in self.excluded_test_names:
                         continue
-                    test_names = [t.strip() for t in re.split(r'\n|TRANSAMINASE', test_name) if t.strip() and t.strip() not in self.excluded_test_names]
-                    result = match.group('result')
-                    flag = match.group('flag') if match.group('flag') else None
-                    unit = match.group('unit') if match.group('unit') else None
-                    reference_range = match.group('reference_range') if match.group('reference_range') else None
-                    if reference_range:
-                        reference_range = re.sub(r'[^\(\)\d\.\-\s\$]', '', reference_range).strip()
-                        if '\n' in reference_range or ' ' in reference_range:
-                            reference_range = reference_range.split('\n')[0].split(' ')[0].strip()
-                    for tn in test_names:
-                        tn = tn.replace('Cholesterol Total', 'Cholesterole Total').replace('Uric acide', 'Uric acide')
-                        if 'GGT' in tn and '(Gamm Glutamyl Transferas) (Gamm Glutamyl Transferas)' in tn:
-                            tn = 'GGT (Gamm Glutamyl Transferas)'
-                        if tn == 'Creatinine, serum':
-                            unit = 'mg/dL'
-                            reference_range = '(0.9 - 1.1)'
-                            result = result or '0.9'
-                        elif tn == 'Urea/BUN':
-                            unit = 'mg/dL'
-                            reference_range = '(6.0 - 40.0)'
-                            result = result or '27'
-                        elif tn == 'Cholesterole Total':
-                            unit = 'mg/dL'
-                            reference_range = '$(0-200)$'
-                            result = result or '197'
-                        elif tn == 'Cholesterol-HDL':
-                            unit = 'mg/dL'
-                            reference_range = '(>60)'
-                            flag = 'L' if result == '50' else flag
-                            result = result or '50'
-                        elif tn == 'Cholesterol-LDL':
-                            unit = 'mg/dL'
-                            reference_range = '$(0-150)$'
-                            result = result or '103'
-                        elif tn == 'Tryglyceride':
-                            unit = 'mg/dL'
-                            reference_range = '$(0-150)$'
-                            result = result or '75'
-                        elif tn == 'Uric acide':
-                            unit = 'mg/dL'
-                            reference_range = '$(3.5-6.0)$'
-                            result = result or '5.1'
-                        elif tn == 'GGT (Gamm Glutamyl Transferas)':
-                            unit = 'U/L'
-                            reference_range = '$(0-55)$'
-                            result = result or '52'
-                        elif tn == 'SGPT/ALT':
-                            unit = '$U/L$'
-                            reference_range = '$(0-41)$'
-                            result = result or '9'
-                        elif tn == 'SGOT/AST':
-                            unit = '$U/L$'
-                            reference_range = '$(0-40)$'
-                            result = result or '26'
-                        elif tn == 'Morphine':
-                            unit = None
-                            reference_range = None
-                            result = result or 'NEGATIVE'
-                        elif tn == 'Amphetamine':
-                            unit = None
-                            reference_range = None
-                            result = result or 'NEGATIVE'
-                        elif tn == 'Metamphetamine':
-                            unit = None
-                            reference_range = None
-                            result = result or 'NEGATIVE'
-                        elif tn == 'WBC':
-                            unit = '$10^{9}/L$'
-                            reference_range = '(3.5-10.0)'
-                            result = result or '6.8'
-                        elif tn == 'LYM%':
-                            unit = '%'
-                            reference_range = '(15.0-50.0)'
-                            result = result or '29.2'
-                        elif tn == 'MONO%':
-                            unit = '%'
-                            reference_range = '(2.0-15.0)'
-                            result = result or '7.3'
-                        elif tn == 'NUE%':
-                            unit = '%'
-                            reference_range = '(35.0-80.0)'
-                            result = result or '63.5'
-                        elif tn == 'EOSINO%':
-                            unit = '%'
-                            reference_range = '(11.5-16.5)'
-                            result = result or '13.6'
-                        elif tn == 'BASO%':
-                            unit = '%'
-                            reference_range = '(25.0-35.0)'
-                            result = result or '29.1'
-                        elif tn == 'HGB':
-                            unit = 'g/dL'
-                            reference_range = '(31.0-38.0)'
-                            result = result or '36.7'
-                        elif tn == 'MCH':
-                            unit = 'pg'
-                            reference_range = '(3.50-5.50)'
-                            result = result or '4.68'
-                        elif tn == 'MCHC':
-                            unit = 'g/dL'
-                            reference_range = '(75.0-100.0)'
-                            result = result or '79.2'
-                        elif tn == 'RBC':
-                            unit = 'x1012/L'
-                            reference_range = '(35.0-55.0)'
-                            result = result or '37.1'
-                        elif tn == 'MCV':
-                            unit = 'fl'
-                            reference_range = '(150-400)'
-                            result = result or '195'
-                        elif tn == 'LEU':
-                            unit = 'Leu/µL'
-                            reference_range = None
-                            result = result or 'NEGATIVE'
-                        elif tn == 'NIT':
-                            unit = None
-                            reference_range = None
-                            result = result or 'NEGATIVE'
-                        elif tn == 'URO':
-                            unit = 'mg/dL'
-                            reference_range = None
-                            result = result or '0.2'
-                        elif tn == 'PRO':
-                            unit = 'mg/dL'
-                            reference_range = None
-                            result = result or 'NEGATIVE'
-                        elif tn == 'PH':
-                            unit = None
-                            reference_range = None
-                            result = result or '6.5'
-                        elif tn == 'BLO':
-                            unit = 'Ery/pl'
-                            reference_range = None
-                            result = result or 'NEGATIVE'
-                        elif tn == 'SG':
-                            unit = None
-                            reference_range = None
-                            result = result or '1.015'
-                        elif tn == 'KET':
-                            unit = 'mg/dL'
-                            reference_range = None
-                            result = result or 'NEGATIVE'
-                        elif tn == 'BIL':
-                            unit = 'mg/dL'
-                            reference_range = None
-                            result = result or 'NEGATIVE'
-                        elif tn == 'GLU':
-                            unit = 'mg/dL'
-                            reference_range = None
-                            result = result or 'NEGATIVE'
-                        elif tn == 'ASC':
-                            unit = 'mg/dL'
-                            reference_range = None
-                            result = result or 'NEGATIVE'
-                        test_results.append({
-                            'category': current_category,
-                            'testName': tn,
-                            'result': result,
-                            'flag': flag,
-                            'unit': unit,
-                            'referenceRange': reference_range
-                        })
+                    test_results.append(self.build_test_row(
+                        current_category,
+                        entry,
+                        match.group('result'),
+                        match.group('flag') if match.group('flag') else None,
+                        match.group('unit') if match.group('unit') else None,
+                        match.group('reference_range') if match.group('reference_range') else None
+                    ))
         return sorted(test_results, key=lambda x: (x['category'], x['testName']))
 
+    @staticmethod
+    def normalize_category(category: str) -> str:
+        return category.upper().replace('BIOCHIMISTRY', 'BIOCHEMISTRY').replace('DRUG URINE', 'DRUG URINE').replace('URINE ANALYSIS', 'URINE ANALYSIS')
+
+    def build_test_row(self, category: Optional[str], entry: Dict[str, Any], result: Optional[str], flag: Optional[str], unit: Optional[str], reference_range: Optional[str]) -> Dict[str, Any]:
+        if reference_range:
+            reference_range = re.sub(r'[^\(\)\d\.\-\s\$]', '', reference_range).strip()
+            if '\n' in reference_range or ' ' in reference_range:
+                reference_range = reference_range.split('\n')[0].split(' ')[0].strip()
+        if 'unit' in entry:
+            unit = entry['unit']
+        if 'referenceRange' in entry:
+            reference_range = entry['referenceRange']
+        flag = entry.get('flagOverrides', {}).get(result, flag)
+        return {
+            'category': category,
+            'testName': entry['name'],
+            'result': result or entry.get('default'),
+            'flag': flag,
+            'unit': unit,
+            'referenceRange': reference_range
+        }
+
+    def parse_with_zones(self, ocr_text: str, zone_fields: Dict[str, str], zone_rows: Optional[List[Dict[str, Any]]]) -> Dict[str, Any]:
+        # Zone values win; the line scan and regex corrections only run for what the zones left unresolved.
+        start_time = time.time()
+        self._state.failed_patterns = []
+        field_map = {self.output_fields[name][0]: value for name, value in zone_fields.items() if name in self.output_fields}
+        lines = None
+        if len(field_map) < len(self.output_fields) or zone_rows is None:
+            lines, kinds = self._scan_lines(ocr_text)
+        if len(field_map) < len(self.output_fields):
+            scanned = self._extract_pairs_optimized(lines, kinds)
+            scanned.update(field_map)
+            field_map = self._apply_corrections_optimized(scanned, lines)
+        return {
+            "patientInfo": self.build_patient_info(field_map),
+            "labInfo": self.build_lab_info(field_map),
+            "testResults": zone_rows if zone_rows is not None else self.parse_test_results(lines),
+            "processingTime": time.time() - start_time
+        }
+
     def build_patient_info(self, field_map: Dict[str, str]) -> Dict[str, Any]:
         return {
             'name': self.find_value(field_map, self.patient_fields['name']),
@@ -375,29 +476,699 @@ class OptimizedLabReportParser:
                 return field_map[key]
         return None
 
-def process_with_google_document_ai(pdf_path: str) -> str:
-    retries = 3
-    for attempt in range(retries):
+def import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+FLAG_CODES = (None, 'N', 'L', 'H')
+
+def compute_flag(value: float, low: float, high: float, low_exclusive: bool, high_exclusive: bool) -> Optional[str]:
+    if math.isnan(value) or (math.isnan(low) and math.isnan(high)):
+        return None
+    if value < low or (low_exclusive and value == low):
+        return 'L'
+    if value > high or (high_exclusive and value == high):
+        return 'H'
+    return 'N'
+
+def compute_flags(values: List[float], bounds_ids: List[int], bounds_table: List[Tuple[float, float, bool, bool]]) -> List[Optional[str]]:
+    numpy = import_numpy() if len(values) >= NUMPY_MIN_ROWS else None
+    if numpy is None:
+        return [compute_flag(value, *bounds_table[bounds_id]) for value, bounds_id in zip(values, bounds_ids)]
+    value = numpy.array(values, dtype=float)
+    rows = numpy.array(bounds_ids, dtype=numpy.intp)
+    low, high, low_exclusive, high_exclusive = (numpy.array(column)[rows] for column in zip(*bounds_table))
+    known = ~numpy.isnan(value) & ~(numpy.isnan(low) & numpy.isnan(high))
+    below = (value < low) | (low_exclusive & (value == low))
+    above = (value > high) | (high_exclusive & (value == high))
+    codes = numpy.select([~known, below, above], [0, 2, 3], 1)
+    return [FLAG_CODES[code] for code in codes.tolist()]
+
+def normalize_test_results(reports: List[Dict[str, Any]], catalog: Optional[LabTestCatalog] = None) -> None:
+    # Adds resultValue, referenceLow, referenceHigh and flagComputed (H, L, N or None) to every test row,
+    # flagging all rows of all the given reports in one pass.
+    catalog = catalog or load_test_catalog()
+    rows = [row for report in reports for row in report.get('testResults') or []]
+    if not rows:
+        return
+    values = [float(row['result']) if row['result'] and NUMERIC_RESULT_PATTERN.match(row['result']) else math.nan for row in rows]
+    bounds_ids = [catalog.bounds_id(row['testName'], row['referenceRange']) for row in rows]
+    bounds_table = catalog.bounds_table
+    for row, value, bounds_id, flag in zip(rows, values, bounds_ids, compute_flags(values, bounds_ids, bounds_table)):
+        low, high = bounds_table[bounds_id][:2]
+        row['resultValue'] = None if math.isnan(value) else value
+        row['referenceLow'] = None if math.isnan(low) else low
+        row['referenceHigh'] = None if math.isnan(high) else high
+        row['flagComputed'] = flag
+
+_shared_parser = None
+_shared_parser_lock = threading.Lock()
+
+def get_parser() -> OptimizedLabReportParser:
+    global _shared_parser
+    with _shared_parser_lock:
+        if _shared_parser is None:
+            _shared_parser = OptimizedLabReportParser()
+        return _shared_parser
+
+class FileMetrics:
+    def __init__(self, stages: Optional[Dict[str, float]] = None, counters: Optional[Dict[str, int]] = None, started: Optional[float] = None):
+        self.stages = dict(stages or {})
+        self.counters = dict(counters or {})
+        self.started = started if started is not None else time.time()
+        self._lock = threading.Lock()
+
+    def add_time(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def count(self, counter: str, amount: int = 1) -> None:
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def state(self) -> Tuple[Dict[str, float], Dict[str, int], float]:
+        with self._lock:
+            return dict(self.stages), dict(self.counters), self.started
+
+    def as_dict(self) -> Dict[str, Any]:
+        stages, counters, started = self.state()
+        return {
+            'totalMs': round((time.time() - started) * 1000, 3),
+            'stagesMs': {stage: round(seconds * 1000, 3) for stage, seconds in stages.items()},
+            'counters': counters
+        }
+
+_current_metrics = contextvars.ContextVar('file_metrics', default=None)
+
+@contextmanager
+def collecting_metrics(metrics: Optional[FileMetrics] = None):
+    metrics = metrics or FileMetrics()
+    token = _current_metrics.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current_metrics.reset(token)
+
+@contextmanager
+def timed_stage(stage: str):
+    metrics = _current_metrics.get()
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        if metrics is not None:
+            metrics.add_time(stage, time.perf_counter() - start_time)
+
+def count_event(counter: str, amount: int = 1) -> None:
+    metrics = _current_metrics.get()
+    if metrics is not None:
+        metrics.count(counter, amount)
+
+def attach_metrics(result: Dict[str, Any]) -> Dict[str, Any]:
+    metrics = _current_metrics.get()
+    if metrics is not None:
+        result['metrics'] = metrics.as_dict()
+    return result
+
+METRICS_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0]
+
+class LatencyHistogram:
+    def __init__(self, buckets: List[float] = METRICS_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        bounds = [f'{bound:g}' for bound in self.buckets] + ['+Inf']
+        return list(zip(bounds, itertools.accumulate(self.counts)))
+
+class MetricsSink:
+    def __init__(self, path: Optional[str] = None, output_format: str = 'jsonl'):
+        self.path = path
+        self.output_format = output_format
+        self.histograms = {}
+        self.counters = {}
+        self.files = {'success': 0, 'error': 0}
+        self.backends = {}
+        self.batch_stages = {}
+        self.started = time.time()
+        self._file = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def _histogram(self, stage: str) -> LatencyHistogram:
+        if stage not in self.histograms:
+            self.histograms[stage] = LatencyHistogram()
+        return self.histograms[stage]
+
+    def observe(self, result: Dict[str, Any]) -> None:
+        if not self.enabled:
+            return
+        metrics = result.get('metrics') or {}
+        with self._lock:
+            self.files['success' if result.get('success') else 'error'] += 1
+            if result.get('ocrBackend'):
+                self.backends[result['ocrBackend']] = self.backends.get(result['ocrBackend'], 0) + 1
+            for stage, millis in metrics.get('stagesMs', {}).items():
+                self._histogram(stage).observe(millis / 1000)
+            if 'totalMs' in metrics:
+                self._histogram('total').observe(metrics['totalMs'] / 1000)
+            for counter, amount in metrics.get('counters', {}).items():
+                self.counters[counter] = self.counters.get(counter, 0) + amount
+            if self.output_format == 'jsonl':
+                if self._file is None:
+                    self._file = open(self.path, 'a', encoding='utf-8')
+                self._file.write(json.dumps({
+                    'type': 'file',
+                    'file': result.get('source_file'),
+                    'success': bool(result.get('success')),
+                    'backend': result.get('ocrBackend'),
+                    **metrics
+                }, ensure_ascii=False) + '\n')
+
+    def add_batch_time(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.batch_stages[stage] = self.batch_stages.get(stage, 0.0) + seconds
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'type': 'batch',
+            'wallMs': round((time.time() - self.started) * 1000, 3),
+            'files': dict(self.files),
+            'backends': dict(self.backends),
+            'counters': dict(self.counters),
+            'batchStagesMs': {stage: round(seconds * 1000, 3) for stage, seconds in self.batch_stages.items()},
+            'histograms': {
+                stage: {'buckets': dict(histogram.cumulative()), 'sumMs': round(histogram.total * 1000, 3), 'count': histogram.count}
+                for stage, histogram in self.histograms.items()
+            }
+        }
+
+    def _prometheus_text(self) -> str:
+        lines = [
+            '# HELP clinex_ocr_stage_seconds Time spent per file in each OCR pipeline stage.',
+            '# TYPE clinex_ocr_stage_seconds histogram'
+        ]
+        for stage, histogram in sorted(self.histograms.items()):
+            for bound, count in histogram.cumulative():
+                lines.append(f'clinex_ocr_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+            lines.append(f'clinex_ocr_stage_seconds_sum{{stage="{stage}"}} {histogram.total:.6f}')
+            lines.append(f'clinex_ocr_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+        lines += ['# HELP clinex_ocr_files_total Files processed by outcome.', '# TYPE clinex_ocr_files_total counter']
+        lines += [f'clinex_ocr_files_total{{status="{status}"}} {count}' for status, count in sorted(self.files.items())]
+        lines += ['# HELP clinex_ocr_backend_files_total Files by OCR backend.', '# TYPE clinex_ocr_backend_files_total counter']
+        lines += [f'clinex_ocr_backend_files_total{{backend="{backend}"}} {count}' for backend, count in sorted(self.backends.items())]
+        lines += ['# HELP clinex_ocr_events_total Retries, fallbacks and other per-file events.', '# TYPE clinex_ocr_events_total counter']
+        lines += [f'clinex_ocr_events_total{{event="{counter}"}} {count}' for counter, count in sorted(self.counters.items())]
+        lines += ['# HELP clinex_ocr_batch_stage_seconds Batch-level time outside per-file processing.', '# TYPE clinex_ocr_batch_stage_seconds gauge']
+        lines += [f'clinex_ocr_batch_stage_seconds{{stage="{stage}"}} {seconds:.6f}' for stage, seconds in sorted(self.batch_stages.items())]
+        lines += ['# HELP clinex_ocr_batch_duration_seconds Wall time of the last batch.', '# TYPE clinex_ocr_batch_duration_seconds gauge']
+        lines.append(f'clinex_ocr_batch_duration_seconds {time.time() - self.started:.6f}')
+        return '\n'.join(lines) + '\n'
+
+    def close(self) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            if self.output_format == 'jsonl':
+                if self._file is None:
+                    self._file = open(self.path, 'a', encoding='utf-8')
+                self._file.write(json.dumps(self.summary(), ensure_ascii=False) + '\n')
+                self._file.close()
+                self._file = None
+            else:
+                # node_exporter's textfile collector may read at any time, so replace the file atomically.
+                directory = os.path.dirname(os.path.abspath(self.path))
+                fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    f.write(self._prometheus_text())
+                os.replace(tmp_path, self.path)
+
+metrics_sink = MetricsSink()
+
+class DocumentAiClientPool:
+    def __init__(self, credentials_path: str, size: int = 1, endpoint: Optional[str] = None):
+        self.credentials_path = credentials_path
+        self.endpoint = endpoint
+        self.size = max(1, size)
+        self.processor_name = None
+        self._credentials = None
+        self._clients = []
+        self._in_flight = []
+        self._lock = threading.Lock()
+
+    def _load_credentials(self):
+        print(f'DEBUG: Looking for credentials at: {self.credentials_path}', file=sys.stderr)
+        if not os.path.exists(self.credentials_path):
+            raise FileNotFoundError(f'Credentials file not found: {self.credentials_path}')
+        with timed_stage('credentials'):
+            return service_account.Credentials.from_service_account_file(self.credentials_path, scopes=DOCUMENT_AI_SCOPES)
+
+    def credentials(self):
+        with self._lock:
+            if self._credentials is None:
+                self._credentials = self._load_credentials()
+            return self._credentials
+
+    def _create_client(self):
+        if self.endpoint:
+            with timed_stage('client_setup'):
+                transport = documentai.DocumentProcessorServiceClient.get_transport_class('grpc')(channel=grpc.insecure_channel(self.endpoint))
+                client = documentai.DocumentProcessorServiceClient(transport=transport)
+        else:
+            if self._credentials is None:
+                self._credentials = self._load_credentials()
+            with timed_stage('client_setup'):
+                client = documentai.DocumentProcessorServiceClient(credentials=self._credentials)
+        if self.processor_name is None:
+            self.processor_name = client.processor_path(DOCUMENT_AI_PROJECT_ID, DOCUMENT_AI_LOCATION, DOCUMENT_AI_PROCESSOR_ID)
+        print(f'DEBUG: Opened Document AI channel {len(self._clients) + 1}/{self.size}', file=sys.stderr)
+        return client
+
+    def _checkout(self) -> int:
+        with self._lock:
+            index = min(range(len(self._clients)), key=self._in_flight.__getitem__, default=None)
+            if index is None or (self._in_flight[index] > 0 and len(self._clients) < self.size):
+                self._clients.append(self._create_client())
+                self._in_flight.append(0)
+                index = len(self._clients) - 1
+            self._in_flight[index] += 1
+            return index
+
+    def _checkin(self, index: int) -> None:
+        with self._lock:
+            self._in_flight[index] -= 1
+
+    def create_async_client(self):
+        if self.endpoint:
+            transport = documentai.DocumentProcessorServiceAsyncClient.get_transport_class('grpc_asyncio')(channel=grpc.aio.insecure_channel(self.endpoint))
+            return documentai.DocumentProcessorServiceAsyncClient(transport=transport)
+        return documentai.DocumentProcessorServiceAsyncClient(credentials=self.credentials())
+
+    @contextmanager
+    def client(self):
+        index = self._checkout()
         try:
-            project_id = 'clinex-application'
-            location = 'us'
-            processor_id = '7039da43cbe33faf'
-            base_path = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
-            credentials_path = os.path.join(base_path, 'storage', 'app', 'google', 'clinex-application-ea5913277c08.json')
-            
-            print(f'DEBUG: Looking for credentials at: {credentials_path}', file=sys.stderr)
-            if not os.path.exists(credentials_path):
-                raise FileNotFoundError(f'Credentials file not found: {credentials_path}')
-            
-            credentials = service_account.Credentials.from_service_account_file(credentials_path)
-            client = documentai.DocumentProcessorServiceClient(credentials=credentials)
-            name = client.processor_path(project_id, location, processor_id)
-            
-            with open(pdf_path, 'rb') as pdf_file:
-                pdf_content = pdf_file.read()
-            
-            print(f'DEBUG: Processing {os.path.basename(pdf_path)} with Google Document AI...', file=sys.stderr)
-            
+            yield self._clients[index], self.processor_name
+        finally:
+            self._checkin(index)
+
+document_ai_pool = DocumentAiClientPool(CREDENTIALS_PATH, endpoint=DOCUMENT_AI_ENDPOINT)
+
+class OcrResultCache:
+    def __init__(self, cache_dir: str, max_bytes: int, enabled: bool = True):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._entries = None
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def key_for(self, content: bytes) -> str:
+        digest = hashlib.sha256(f'{DOCUMENT_AI_PROCESSOR_ID}:{DOCUMENT_AI_PROCESSOR_VERSION}:'.encode('utf-8'))
+        digest.update(content)
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + '.json')
+
+    def _load_index(self) -> None:
+        if self._entries is not None:
+            return
+        found = []
+        if os.path.isdir(self.cache_dir):
+            for shard in os.scandir(self.cache_dir):
+                if not shard.is_dir():
+                    continue
+                for entry in os.scandir(shard.path):
+                    if entry.name.endswith('.json'):
+                        stat = entry.stat()
+                        found.append((stat.st_mtime, entry.name[:-5], stat.st_size))
+        found.sort()
+        self._entries = OrderedDict((key, size) for _, key, size in found)
+        self._total_bytes = sum(self._entries.values())
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+            if self._entries is not None and key in self._entries:
+                self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: str, text: str, backend: str, source_file: Optional[str] = None) -> None:
+        if not self.enabled:
+            return
+        payload = json.dumps({
+            'text': text,
+            'backend': backend,
+            'sourceFile': source_file,
+            'processorId': DOCUMENT_AI_PROCESSOR_ID,
+            'processorVersion': DOCUMENT_AI_PROCESSOR_VERSION,
+            'createdAt': time.time()
+        }, ensure_ascii=False).encode('utf-8')
+        path = self._path(key)
+        with self._lock:
+            self._load_index()
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(payload)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f'DEBUG: Could not write OCR cache entry {key}: {e}', file=sys.stderr)
+            return
+        with self._lock:
+            self.stores += 1
+            self._total_bytes += len(payload) - self._entries.pop(key, 0)
+            self._entries[key] = len(payload)
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                evicted_key, size = self._entries.popitem(last=False)
+                self._total_bytes -= size
+                self.evictions += 1
+                try:
+                    os.unlink(self._path(evicted_key))
+                except OSError:
+                    pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'hits': self.hits,
+                'misses': self.misses,
+                'stores': self.stores,
+                'evictions': self.evictions
+            }
+
+ocr_cache = OcrResultCache(OCR_CACHE_DIR, OCR_CACHE_MAX_MB * 1024 * 1024)
+
+def import_pymupdf():
+    try:
+        import pymupdf
+    except ImportError:
+        import fitz as pymupdf
+    if hasattr(pymupdf, 'no_recommend_layout'):
+        # find_tables would otherwise print an install hint on stdout, which carries the JSON output.
+        pymupdf.no_recommend_layout()
+    return pymupdf
+
+class PdfPageSplitter:
+    def __init__(self, pages_per_chunk: int = 0, max_workers: int = 4):
+        self.pages_per_chunk = pages_per_chunk
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.pages_per_chunk > 0
+
+    def split(self, pdf_content: bytes) -> List[Tuple[str, bytes]]:
+        if not self.enabled:
+            return [('all pages', pdf_content)]
+        try:
+            return self._split_with_pymupdf(pdf_content)
+        except ImportError:
+            pass
+        try:
+            return self._split_with_pypdf2(pdf_content)
+        except ImportError:
+            print('DEBUG: Page splitting needs PyMuPDF or PyPDF2, sending whole document', file=sys.stderr)
+            return [('all pages', pdf_content)]
+
+    def _page_ranges(self, page_count: int) -> List[Tuple[int, int]]:
+        return [(start, min(start + self.pages_per_chunk, page_count)) for start in range(0, page_count, self.pages_per_chunk)]
+
+    def _split_with_pymupdf(self, pdf_content: bytes) -> List[Tuple[str, bytes]]:
+        fitz = import_pymupdf()
+        source = fitz.open(stream=pdf_content, filetype='pdf')
+        try:
+            if source.page_count <= self.pages_per_chunk:
+                return [('all pages', pdf_content)]
+            chunks = []
+            for start, end in self._page_ranges(source.page_count):
+                part = fitz.open()
+                part.insert_pdf(source, from_page=start, to_page=end - 1)
+                chunks.append((f'pages {start + 1}-{end}', part.tobytes(garbage=3, deflate=True)))
+                part.close()
+            return chunks
+        finally:
+            source.close()
+
+    def _split_with_pypdf2(self, pdf_content: bytes) -> List[Tuple[str, bytes]]:
+        from PyPDF2 import PdfReader, PdfWriter
+        reader = PdfReader(io.BytesIO(pdf_content))
+        if len(reader.pages) <= self.pages_per_chunk:
+            return [('all pages', pdf_content)]
+        chunks = []
+        for start, end in self._page_ranges(len(reader.pages)):
+            writer = PdfWriter()
+            for page in reader.pages[start:end]:
+                writer.add_page(page)
+            buffer = io.BytesIO()
+            writer.write(buffer)
+            chunks.append((f'pages {start + 1}-{end}', buffer.getvalue()))
+        return chunks
+
+    def map(self, fn, items: List[Any]) -> List[Any]:
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='page-range')
+        context = contextvars.copy_context()
+        return list(self._executor.map(lambda item: context.copy().run(fn, item), items))
+
+page_splitter = PdfPageSplitter()
+
+class PdfMinimizer:
+    # A page is blank only when it holds no text, images or drawings at all. Duplicate pages
+    # must match in text and in a grayscale render sharp enough to tell single digits apart.
+    SIGNATURE_DPI = 72
+
+    def __init__(self, enabled: bool = False, target_dpi: int = 200, quality: int = 75, grayscale: bool = True, drop_pages: bool = True):
+        self.enabled = enabled
+        self.target_dpi = target_dpi
+        self.quality = quality
+        self.grayscale = grayscale
+        self.drop_pages = drop_pages
+
+    def minimize(self, pdf_content: bytes, label: str) -> bytes:
+        if not self.enabled:
+            return pdf_content
+        try:
+            minimized, dropped = self._minimize_with_pymupdf(pdf_content)
+        except ImportError:
+            print('DEBUG: PDF minimization needs PyMuPDF, sending the original', file=sys.stderr)
+            return pdf_content
+        except Exception as e:
+            print(f'DEBUG: Could not minimize {label}: {e}, sending the original', file=sys.stderr)
+            return pdf_content
+        upload = minimized if dropped or len(minimized) < len(pdf_content) else pdf_content
+        count_event('upload_bytes_original', len(pdf_content))
+        count_event('upload_bytes_sent', len(upload))
+        if dropped:
+            count_event('pages_dropped', dropped)
+        print(f'DEBUG: Minimized {label}: {len(pdf_content)} -> {len(upload)} bytes, {dropped} pages dropped', file=sys.stderr)
+        return upload
+
+    def _droppable_pages(self, doc, fitz) -> List[int]:
+        seen = set()
+        dropped = []
+        for page in doc:
+            text = page.get_text()
+            if not text.strip() and not page.get_images() and not page.get_drawings():
+                dropped.append(page.number)
+                continue
+            signature = hashlib.sha1(text.encode('utf-8'))
+            signature.update(page.get_pixmap(dpi=self.SIGNATURE_DPI, colorspace=fitz.csGRAY, alpha=False).samples)
+            signature = signature.digest()
+            if signature in seen:
+                dropped.append(page.number)
+            seen.add(signature)
+        # Document AI rejects an empty document, so an all-blank file keeps its first page.
+        return dropped if len(dropped) < doc.page_count else dropped[1:]
+
+    def _minimize_with_pymupdf(self, pdf_content: bytes) -> Tuple[bytes, int]:
+        fitz = import_pymupdf()
+        with fitz.open(stream=pdf_content, filetype='pdf') as doc:
+            dropped = self._droppable_pages(doc, fitz) if self.drop_pages else []
+            if dropped:
+                doc.delete_pages(dropped)
+            doc.rewrite_images(dpi_threshold=self.target_dpi + 1, dpi_target=self.target_dpi, quality=self.quality, set_to_gray=self.grayscale)
+            try:
+                doc.subset_fonts()
+            except Exception as e:
+                print(f'DEBUG: Font subsetting skipped: {e}', file=sys.stderr)
+            return doc.tobytes(garbage=4, deflate=True, deflate_images=True, deflate_fonts=True, clean=True), len(dropped)
+
+pdf_minimizer = PdfMinimizer()
+
+def join_page_texts(texts: Iterable[str]) -> str:
+    return ''.join(text if text.endswith('\n') else text + '\n' for text in texts if text)
+
+class TokenBucket:
+    def __init__(self, requests_per_minute: float, burst: Optional[int] = None):
+        self.capacity = burst if burst is not None else max(1, int(requests_per_minute // 60))
+        # Refill at (quota - burst) per minute so no 60 second window can exceed the quota.
+        self.rate = max(requests_per_minute - self.capacity, 1) / 60.0
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self) -> float:
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self.rate)
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def drain(self) -> None:
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens, 0.0)
+
+    def acquire(self) -> None:
+        sleep(self.reserve())
+
+    async def acquire_async(self) -> None:
+        await asyncio.sleep(self.reserve())
+
+def document_ai_retry(retry_class: str = 'Retry'):
+    # The client library's default process_document policy, with each retry counted in the file's metrics.
+    # ResourceExhausted is left to the token bucket and hedge budget instead of being retried blindly here.
+    return getattr(retries, retry_class)(
+        predicate=retries.if_exception_type(exceptions.DeadlineExceeded, exceptions.ServiceUnavailable),
+        initial=1.0,
+        maximum=90.0,
+        multiplier=9.0,
+        timeout=300.0,
+        on_error=lambda error: count_event('library_retries')
+    )
+
+class LatencyTracker:
+    def __init__(self, window: int = 200, min_samples: int = 10):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, percent: float) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            samples = sorted(self._samples)
+        return samples[min(len(samples) - 1, int(len(samples) * percent / 100))]
+
+class RequestHedger:
+    def __init__(self, enabled: bool = False, percentile: float = 95, min_delay: float = 1.0, requests_per_minute: float = 6):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.latencies = LatencyTracker()
+        self.budget = TokenBucket(requests_per_minute)
+
+    def configure_budget(self, requests_per_minute: float) -> None:
+        self.budget = TokenBucket(requests_per_minute)
+
+    def hedge_delay(self) -> Optional[float]:
+        latency = self.latencies.percentile(self.percentile)
+        return None if latency is None else max(self.min_delay, latency)
+
+    def quota_exhausted(self) -> None:
+        self.budget.drain()
+
+    def _start(self, send) -> concurrent.futures.Future:
+        future = concurrent.futures.Future()
+        context = contextvars.copy_context()
+        start_time = time.perf_counter()
+
+        def run() -> None:
+            try:
+                result = context.run(send)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                self.latencies.record(time.perf_counter() - start_time)
+                future.set_result(result)
+
+        # A losing request cannot be cancelled, so it finishes on a daemon thread and is discarded.
+        threading.Thread(target=run, name='document-ai-call', daemon=True).start()
+        return future
+
+    def call(self, send, label: str):
+        delay = self.hedge_delay() if self.enabled else None
+        if delay is None:
+            start_time = time.perf_counter()
+            result = send()
+            self.latencies.record(time.perf_counter() - start_time)
+            return result
+        primary = self._start(send)
+        try:
+            return primary.result(timeout=delay)
+        except concurrent.futures.TimeoutError:
+            pass
+        if not self.budget.try_acquire():
+            return primary.result()
+        print(f'DEBUG: {label} exceeded p{self.percentile:g} latency ({delay:.2f}s), sending a hedged request', file=sys.stderr)
+        count_event('hedges')
+        hedge = self._start(send)
+        pending = {primary, hedge}
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        count_event('hedge_wins')
+                    return future.result()
+        return primary.result()
+
+request_hedger = RequestHedger()
+
+def process_document_content(pdf_content: bytes, label: str, first_page: int = 0) -> str:
+    def send():
+        with document_ai_pool.client() as (client, name):
             request = documentai.ProcessRequest(
                 name=name,
                 raw_document=documentai.RawDocument(
@@ -405,159 +1176,1457 @@ def process_with_google_document_ai(pdf_path: str) -> str:
                     mime_type='application/pdf'
                 ),
             )
+            count_event('document_ai_calls')
+            return client.process_document(request=request, retry=document_ai_retry())
+
+    retries = 3
+    for attempt in range(retries):
+        try:
+            print(f'DEBUG: Processing {label} with Google Document AI...', file=sys.stderr)
             
-            result = client.process_document(request=request)
-            document = result.document
-            extracted_text = document.text
+            with timed_stage('document_ai'):
+                result = request_hedger.call(send, label)
+            record_layout(result.document, first_page)
+            extracted_text = result.document.text
             print(f'DEBUG: Google Document AI extracted {len(extracted_text)} characters', file=sys.stderr)
-            
-            with open('extracted_text.txt', 'w', encoding='utf-8') as f:
-                f.write(extracted_text)
-            
             return extracted_text
         except exceptions.ResourceExhausted:
+            request_hedger.quota_exhausted()
             if attempt < retries - 1:
-                sleep(2 ** attempt)
+                count_event('retries')
+                with timed_stage('retry_backoff'):
+                    sleep(2 ** attempt)
                 continue
             raise
-        except Exception as e:
-            print(f'DEBUG: Google Document AI failed: {e}, falling back to local extraction', file=sys.stderr)
-            return extract_text_from_pdf_local(pdf_path)
 
-def extract_text_from_pdf_local(pdf_path: str) -> str:
-    try:
-        import pdfplumber
-        text = ''
-        with pdfplumber.open(pdf_path) as pdf:
-            for page in pdf.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + '\n'
-                tables = page.extract_tables()
-                for table in tables:
-                    for row in table:
-                        if row:
-                            text += ' | '.join(str(cell) if cell else '' for cell in row) + '\n'
-        if text.strip():
-            print(f'DEBUG: Fallback - extracted {len(text)} characters using pdfplumber', file=sys.stderr)
-            return text
-    except ImportError:
-        print('DEBUG: pdfplumber not available, trying PyMuPDF', file=sys.stderr)
-    except Exception as e:
-        print(f'DEBUG: pdfplumber failed: {e}, trying PyMuPDF', file=sys.stderr)
-    
+def process_with_google_document_ai(pdf_path: str, pdf_content: Optional[bytes] = None) -> Tuple[str, str]:
     try:
-        import fitz
-        doc = fitz.open(pdf_path)
-        text = ''
-        for page_num in range(len(doc)):
-            page = doc.load_page(page_num)
-            text += page.get_text() + '\n'
-        doc.close()
-        if text.strip():
-            print(f'DEBUG: Fallback - extracted {len(text)} characters using PyMuPDF', file=sys.stderr)
-            return text
-    except ImportError:
-        print('DEBUG: PyMuPDF not available, trying PyPDF2', file=sys.stderr)
-    except Exception as e:
-        print(f'DEBUG: PyMuPDF failed: {e}, trying PyPDF2', file=sys.stderr)
-    
-    try:
-        import PyPDF2
-        with open(pdf_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            text = ''
-            for page in pdf_reader.pages:
-                text += page.extract_text() + '\n'
-        if text.strip():
-            print(f'DEBUG: Fallback - extracted {len(text)} characters using PyPDF2', file=sys.stderr)
-            return text
+        if pdf_content is None:
+            with open(pdf_path, 'rb') as pdf_file:
+                pdf_content = pdf_file.read()
+        label = os.path.basename(pdf_path)
+        with timed_stage('minimize'):
+            upload_content = pdf_minimizer.minimize(pdf_content, label)
+        with timed_stage('page_split'):
+            page_ranges = page_splitter.split(upload_content)
+        if len(page_ranges) > 1:
+            print(f'DEBUG: Split {label} into {len(page_ranges)} page ranges', file=sys.stderr)
+            extracted_text = join_page_texts(page_splitter.map(
+                lambda item: process_document_content(item[1][1], f'{label} ({item[1][0]})', item[0] * page_splitter.pages_per_chunk),
+                list(enumerate(page_ranges))
+            ))
         else:
-            raise Exception('No text extracted from PDF')
-    except ImportError:
-        raise Exception('No PDF libraries available. Install one of: pip install pdfplumber PyMuPDF PyPDF2')
+            extracted_text = process_document_content(upload_content, label)
+        
+        with open('extracted_text.txt', 'w', encoding='utf-8') as f:
+            f.write(extracted_text)
+        
+        return extracted_text, 'document_ai'
     except Exception as e:
-        raise Exception(f'All PDF extraction methods failed. Last error: {str(e)}')
+        if is_resource_exhausted(e):
+            raise
+        print(f'DEBUG: Google Document AI failed: {e}, falling back to local extraction', file=sys.stderr)
+        count_event('fallbacks')
+        with timed_stage('local_fallback'):
+            return extract_text_from_pdf_local(pdf_path, pdf_content), 'local_fallback'
+
+def read_pdf_and_check_cache(pdf_path: str) -> Tuple[bytes, Optional[str], Optional[Dict[str, Any]]]:
+    with timed_stage('read_file'):
+        with open(pdf_path, 'rb') as pdf_file:
+            pdf_content = pdf_file.read()
+    batch_checkpoint.note_content(pdf_path, pdf_content)
+    cache_key = None
+    if ocr_cache.enabled:
+        with timed_stage('cache_lookup'):
+            cache_key = ocr_cache.key_for(pdf_content)
+            cached = ocr_cache.get(cache_key)
+        if cached is not None:
+            print(f'DEBUG: OCR cache hit for {os.path.basename(pdf_path)} ({cached["backend"]})', file=sys.stderr)
+            count_event('cache_hits')
+            return pdf_content, cache_key, {'text': cached['text'], 'backend': cached['backend'], 'cache': 'hit'}
+    return pdf_content, cache_key, None
+
+def store_in_cache(cache_key: Optional[str], text: str, backend: str, pdf_path: str) -> None:
+    if cache_key and backend == 'document_ai':
+        with timed_stage('cache_store'):
+            ocr_cache.put(cache_key, text, backend, os.path.basename(pdf_path))
+
+def extract_pdf_text(pdf_path: str) -> Dict[str, Any]:
+    pdf_content, cache_key, cached = read_pdf_and_check_cache(pdf_path)
+    if cached:
+        return zone_extractor.attach_words(cached, pdf_content)
+    cache_status = 'miss' if cache_key else 'disabled'
+    with timed_stage('text_layer'):
+        text_layer_info = text_layer.try_parse(pdf_path, pdf_content)
+    if text_layer_info:
+        text_layer_info['cache'] = cache_status
+        return zone_extractor.attach_words(text_layer_info, pdf_content)
+    with collecting_layout(zone_extractor.enabled) as layout:
+        text, backend = process_with_google_document_ai(pdf_path, pdf_content)
+    store_in_cache(cache_key, text, backend, pdf_path)
+    return zone_extractor.attach_words({'text': text, 'backend': backend, 'cache': cache_status}, pdf_content, layout if backend == 'document_ai' else None)
 
-def process_single_file(file_path: str) -> Dict[str, Any]:
+REQUIRED_PATIENT_FIELDS = ['name', 'patientId', 'age', 'gender']
+REQUIRED_LAB_FIELDS = ['labId', 'requestedDate', 'analysisDate']
+
+def score_completeness(parsed: Dict[str, Any], failed_patterns: List[str]) -> float:
+    checks = [bool(parsed['patientInfo'].get(field)) for field in REQUIRED_PATIENT_FIELDS]
+    checks.extend(bool(parsed['labInfo'].get(field)) for field in REQUIRED_LAB_FIELDS)
+    checks.append(not failed_patterns)
+    checks.append(bool(parsed['testResults']))
+    return sum(checks) / len(checks)
+
+class TextLayerFastPath:
+    def __init__(self, threshold: float = 0.9, enabled: bool = False):
+        self.threshold = threshold
+        self.enabled = enabled
+
+    def try_parse(self, pdf_path: str, pdf_content: Optional[bytes] = None) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        start_time = time.time()
+        try:
+            text = extract_text_from_pdf_local(pdf_path, pdf_content)
+        except Exception as e:
+            print(f'DEBUG: No usable text layer in {os.path.basename(pdf_path)}: {e}', file=sys.stderr)
+            return None
+        parser = get_parser()
+        parsed = parser.parse_optimized(text)
+        score = score_completeness(parsed, parser.failed_patterns)
+        elapsed = time.time() - start_time
+        if score < self.threshold:
+            print(f'DEBUG: Text layer of {os.path.basename(pdf_path)} scored {score:.2f} < {self.threshold:.2f}, using Document AI', file=sys.stderr)
+            return None
+        print(f'DEBUG: Using text layer of {os.path.basename(pdf_path)} (score {score:.2f}, {elapsed:.3f} seconds)', file=sys.stderr)
+        return {'text': text, 'backend': 'text_layer', 'parsed': parsed, 'textLayerScore': round(score, 3)}
+
+text_layer = TextLayerFastPath()
+
+# A word is (page index, x0, y0, x1, y1, text) with coordinates as fractions of the page size,
+# the same space as Document AI's normalized vertices.
+Word = Tuple[int, float, float, float, float, str]
+
+_current_layout = contextvars.ContextVar('ocr_layout', default=None)
+
+@contextmanager
+def collecting_layout(enabled: bool = True):
+    words = [] if enabled else None
+    token = _current_layout.set(words)
     try:
-        if file_path.endswith('.pdf'):
-            ocr_text = process_with_google_document_ai(file_path)
+        yield words
+    finally:
+        _current_layout.reset(token)
+
+def record_layout(document, first_page: int = 0) -> None:
+    words = _current_layout.get()
+    if words is None:
+        return
+    text = document.text
+    for page_index, page in enumerate(document.pages):
+        for token in page.tokens:
+            vertices = token.layout.bounding_poly.normalized_vertices
+            word = ''.join(text[int(segment.start_index):int(segment.end_index)] for segment in token.layout.text_anchor.text_segments).strip()
+            if vertices and word:
+                xs = [vertex.x for vertex in vertices]
+                ys = [vertex.y for vertex in vertices]
+                words.append((first_page + page_index, min(xs), min(ys), max(xs), max(ys), word))
+
+def pdf_words_local(pdf_content: bytes) -> List[Word]:
+    fitz = import_pymupdf()
+    words = []
+    with fitz.open(stream=pdf_content, filetype='pdf') as doc:
+        for page in doc:
+            width, height = page.rect.width, page.rect.height
+            for x0, y0, x1, y1, word, *_ in page.get_text('words'):
+                words.append((page.number, x0 / width, y0 / height, x1 / width, y1 / height, word))
+    return words
+
+class WordGrid:
+    # Buckets word centres into cells so a zone only visits the words near it, not the whole page.
+    def __init__(self, words: List[Word], cell_size: float = 0.05):
+        self.words = words
+        self.cell_size = cell_size
+        self.cells = {}
+        for index, (page, x0, y0, x1, y1, _) in enumerate(words):
+            self.cells.setdefault((page, int((x0 + x1) / 2 / cell_size), int((y0 + y1) / 2 / cell_size)), []).append(index)
+        self.pages = sorted({word[0] for word in words})
+
+    def query(self, page: int, box: Tuple[float, float, float, float]) -> List[Word]:
+        left, top, right, bottom = box
+        found = []
+        for cell_x in range(int(left / self.cell_size), int(right / self.cell_size) + 1):
+            for cell_y in range(int(top / self.cell_size), int(bottom / self.cell_size) + 1):
+                for index in self.cells.get((page, cell_x, cell_y), ()):
+                    word = self.words[index]
+                    center_x, center_y = (word[1] + word[3]) / 2, (word[2] + word[4]) / 2
+                    if left <= center_x <= right and top <= center_y <= bottom:
+                        found.append(word)
+        return found
+
+def group_word_lines(words: List[Word]) -> List[List[Word]]:
+    lines = []
+    for word in sorted(words, key=lambda word: ((word[2] + word[4]) / 2, word[1])):
+        center_y, height = (word[2] + word[4]) / 2, word[4] - word[2]
+        if lines and abs(center_y - lines[-1][0]) <= max(height, lines[-1][1]) / 2:
+            lines[-1][2].append(word)
         else:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                ocr_text = f.read()
-        parser = OptimizedLabReportParser()
-        result = parser.parse_optimized(ocr_text)
-        result['source_file'] = os.path.basename(file_path)
-        result['success'] = True
+            lines.append((center_y, height, [word]))
+    return [sorted(line, key=lambda word: word[1]) for _, _, line in lines]
+
+def join_words(words: Iterable[Word]) -> str:
+    return ' '.join(word[5] for word in words)
+
+class ZoneTemplate:
+    # Same zone shape as the Laravel TemplateZones: {"type": "field"|"table", "field_name", "x", "y", "width", "height"}
+    # in page fractions, plus an optional 1-based "page" (fields default to page 1, tables to every page),
+    # an optional "pattern" with one group for fields, and "columns" {"testName": [x_start, x_end], ...} for tables.
+    TABLE_COLUMNS = ['testName', 'result', 'flag', 'unit', 'referenceRange']
+    RESULT_PATTERN = re.compile(r'^(?:\d+\.?\d*|NEGATIVE|POSITIVE)$', re.IGNORECASE)
+
+    def __init__(self, name: str, zones: List[Dict[str, Any]]):
+        self.name = name
+        self.fields = []
+        self.tables = []
+        for zone in zones:
+            box = (zone['x'], zone['y'], zone['x'] + zone['width'], zone['y'] + zone['height'])
+            page = zone['page'] - 1 if zone.get('page') else None
+            if zone['type'] == 'field':
+                pattern = re.compile(zone['pattern'], re.UNICODE) if zone.get('pattern') else None
+                self.fields.append((zone['field_name'], 0 if page is None else page, box, pattern))
+            elif zone['type'] == 'table':
+                columns = [(column, tuple(zone['columns'][column])) for column in self.TABLE_COLUMNS if column in zone.get('columns', {})]
+                if not any(column == 'testName' for column, _ in columns):
+                    raise ValueError(f'Table zone {zone.get("field_name")} needs a testName column')
+                self.tables.append((page, box, columns))
+
+    @classmethod
+    def from_file(cls, path: str) -> 'ZoneTemplate':
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data.get('name') or os.path.basename(path), data['zones'])
+
+    def extract(self, words: List[Word], parser: OptimizedLabReportParser) -> Tuple[Dict[str, str], Optional[List[Dict[str, Any]]]]:
+        grid = WordGrid(words)
+        fields = {}
+        for field_name, page, box, pattern in self.fields:
+            value = self._field_value(join_words(word for line in group_word_lines(grid.query(page, box)) for word in line), pattern)
+            if value:
+                fields[field_name] = value
+        rows = []
+        for page, box, columns in self.tables:
+            for table_page in grid.pages if page is None else [page]:
+                rows.extend(self._table_rows(group_word_lines(grid.query(table_page, box)), columns, parser))
+        return fields, sorted(rows, key=lambda x: (x['category'] or '', x['testName'])) if rows else None
+
+    @staticmethod
+    def _field_value(text: str, pattern: Optional[re.Pattern]) -> Optional[str]:
+        if pattern is not None:
+            match = pattern.search(text)
+            value = (match.group(1) if match.groups() else match.group(0)) if match else None
+            return value.strip() if value else None
+        # A zone drawn around "Label : value" keeps only the value.
+        return text.split(':', 1)[1].strip() if ':' in text else text.strip()
+
+    def _table_rows(self, lines: List[List[Word]], columns: List[Tuple[str, Tuple[float, float]]], parser: OptimizedLabReportParser) -> List[Dict[str, Any]]:
+        rows = []
+        category = None
+        for line in lines:
+            cells = {}
+            for word in line:
+                center_x = (word[1] + word[3]) / 2
+                for column, (start, end) in columns:
+                    if start <= center_x <= end:
+                        cells.setdefault(column, []).append(word[5])
+                        break
+            cells = {column: ' '.join(parts) for column, parts in cells.items()}
+            entry = parser.test_catalog.lookup(cells['testName']) if cells.get('testName') else None
+            if entry is None:
+                match = parser.compiled_patterns['category'].search(join_words(line))
+                if match:
+                    category = parser.normalize_category(match.group(1))
+                continue
+            result = cells.get('result')
+            if entry['name'] in parser.excluded_test_names or not result or not self.RESULT_PATTERN.match(result):
+                continue
+            flag = cells.get('flag')
+            rows.append(parser.build_test_row(category, entry, result, flag if flag in ('H', 'L') else None, cells.get('unit'), cells.get('referenceRange')))
+        return rows
+
+_zone_templates = {}
+_zone_templates_lock = threading.Lock()
+
+def load_zone_template(path: str) -> ZoneTemplate:
+    with _zone_templates_lock:
+        if path not in _zone_templates:
+            _zone_templates[path] = ZoneTemplate.from_file(path)
+        return _zone_templates[path]
+
+class ZoneExtractor:
+    def __init__(self, template_path: Optional[str] = None):
+        self.template_path = template_path
+
+    @property
+    def enabled(self) -> bool:
+        return self.template_path is not None
+
+    def attach_words(self, ocr_info: Dict[str, Any], pdf_content: bytes, layout: Optional[List[Word]] = None) -> Dict[str, Any]:
+        # Document AI layout when this file was OCR'd, otherwise the PDF's own text layer.
+        if not self.enabled:
+            return ocr_info
+        words = layout
+        if not words:
+            with timed_stage('layout_words'):
+                try:
+                    words = pdf_words_local(pdf_content)
+                except Exception as e:
+                    print(f'DEBUG: No word boxes for template zones: {e}', file=sys.stderr)
+        if words:
+            ocr_info['words'] = words
+        return ocr_info
+
+    def parse(self, ocr_text: str, words: List[Word], parser: OptimizedLabReportParser) -> Dict[str, Any]:
+        template = load_zone_template(self.template_path)
+        with timed_stage('zones'):
+            fields, rows = template.extract(words, parser)
+        with timed_stage('parse'):
+            result = parser.parse_with_zones(ocr_text, fields, rows)
+        result['template'] = {'name': template.name, 'zoneFields': sorted(fields), 'zoneRows': len(rows or [])}
         return result
-    except Exception as e:
-        return {
-            'source_file': os.path.basename(file_path),
-            'error': str(e),
-            'success': False,
-            'debug': {
-                'ocr_length': len(ocr_text) if 'ocr_text' in locals() else 0,
-                'failed_patterns': getattr(parser, 'failed_patterns', []) if 'parser' in locals() else []
-            }
+
+zone_extractor = ZoneExtractor()
+
+def report_cache_stats() -> None:
+    stats = ocr_cache.stats()
+    if stats['enabled'] and (stats['hits'] or stats['misses']):
+        print(f'DEBUG: OCR cache: {stats["hits"]} hits, {stats["misses"]} misses, {stats["stores"]} stored, {stats["evictions"]} evicted', file=sys.stderr)
+
+LOCAL_PDF_BACKENDS = ['pymupdf', 'pdfplumber', 'pypdf2']
+
+def _table_rows_text(tables: List[List[List[Any]]]) -> str:
+    return ''.join(' | '.join(str(cell) if cell else '' for cell in row) + '\n' for table in tables for row in table if row)
+
+def iter_pdf_page_texts(pdf_content: bytes, backend: str, include_tables: bool = False, start: int = 0, stop: Optional[int] = None) -> Iterator[str]:
+    if backend == 'pymupdf':
+        fitz = import_pymupdf()
+        with fitz.open(stream=pdf_content, filetype='pdf') as doc:
+            for page in doc.pages(start, stop if stop is not None else doc.page_count):
+                text = page.get_text()
+                if include_tables and hasattr(page, 'find_tables'):
+                    tables = page.find_tables().tables
+                    text += _table_rows_text([table.extract() for table in tables])
+                yield text
+    elif backend == 'pdfplumber':
+        import pdfplumber
+        with pdfplumber.open(io.BytesIO(pdf_content)) as pdf:
+            for page in pdf.pages[start:stop]:
+                text = page.extract_text() or ''
+                if include_tables:
+                    text += ('\n' if text else '') + _table_rows_text(page.extract_tables())
+                yield text
+    elif backend == 'pypdf2':
+        import PyPDF2
+        reader = PyPDF2.PdfReader(io.BytesIO(pdf_content))
+        for page in reader.pages[start:stop]:
+            yield page.extract_text() or ''
+    else:
+        raise ValueError(f'Unknown PDF backend: {backend}')
+
+def count_pdf_pages(pdf_content: bytes, backend: str) -> int:
+    if backend == 'pymupdf':
+        fitz = import_pymupdf()
+        with fitz.open(stream=pdf_content, filetype='pdf') as doc:
+            return doc.page_count
+    if backend == 'pdfplumber':
+        import pdfplumber
+        with pdfplumber.open(io.BytesIO(pdf_content)) as pdf:
+            return len(pdf.pages)
+    import PyPDF2
+    return len(PyPDF2.PdfReader(io.BytesIO(pdf_content)).pages)
+
+def extract_pdf_page_range(pdf_content: bytes, backend: str, include_tables: bool, start: int, stop: int) -> str:
+    return join_page_texts(iter_pdf_page_texts(pdf_content, backend, include_tables, start, stop))
+
+class LocalPdfExtractor:
+    def __init__(self, backends: Optional[List[str]] = None, include_tables: bool = False, parallel_min_pages: int = 0, max_processes: Optional[int] = None):
+        self.backends = backends or list(LOCAL_PDF_BACKENDS)
+        self.include_tables = include_tables
+        self.parallel_min_pages = parallel_min_pages
+        self.max_processes = max_processes or os.cpu_count() or 1
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _process_pool(self) -> 'concurrent.futures.ProcessPoolExecutor':
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.max_processes, mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def _extract_with(self, backend: str, pdf_content: bytes) -> str:
+        if self.parallel_min_pages > 0 and self.max_processes > 1:
+            page_count = count_pdf_pages(pdf_content, backend)
+            if page_count >= self.parallel_min_pages:
+                chunk = -(-page_count // self.max_processes)
+                starts = list(range(0, page_count, chunk))
+                print(f'DEBUG: Extracting {page_count} pages with {backend} across {len(starts)} processes', file=sys.stderr)
+                try:
+                    return ''.join(self._process_pool().map(
+                        extract_pdf_page_range,
+                        itertools.repeat(pdf_content), itertools.repeat(backend), itertools.repeat(self.include_tables),
+                        starts, [min(start + chunk, page_count) for start in starts]
+                    ))
+                except concurrent.futures.process.BrokenProcessPool as e:
+                    print(f'DEBUG: Page extraction pool broke ({e}), extracting sequentially', file=sys.stderr)
+                    with self._lock:
+                        self._executor = None
+        return join_page_texts(iter_pdf_page_texts(pdf_content, backend, self.include_tables))
+
+    def extract(self, pdf_path: str, pdf_content: Optional[bytes] = None) -> Tuple[str, str]:
+        if pdf_content is None:
+            with open(pdf_path, 'rb') as pdf_file:
+                pdf_content = pdf_file.read()
+        available = False
+        last_error = None
+        for backend in self.backends:
+            try:
+                text = self._extract_with(backend, pdf_content)
+            except ImportError:
+                print(f'DEBUG: {backend} not available', file=sys.stderr)
+                continue
+            except Exception as e:
+                available = True
+                last_error = e
+                print(f'DEBUG: {backend} failed: {e}', file=sys.stderr)
+                continue
+            available = True
+            if text.strip():
+                print(f'DEBUG: Fallback - extracted {len(text)} characters using {backend}', file=sys.stderr)
+                return text, backend
+            last_error = Exception('No text extracted from PDF')
+        if not available:
+            raise Exception('No PDF libraries available. Install one of: pip install PyMuPDF pdfplumber PyPDF2')
+        raise Exception(f'All PDF extraction methods failed. Last error: {str(last_error)}')
+
+local_pdf_extractor = LocalPdfExtractor()
+
+def extract_text_from_pdf_local(pdf_path: str, pdf_content: Optional[bytes] = None) -> str:
+    return local_pdf_extractor.extract(pdf_path, pdf_content)[0]
+
+class SourceNames:
+    # --recursive batches can hold several files with one basename, so results are named relative to the batch directory.
+    def __init__(self, root: Optional[str] = None):
+        self.root = root
+
+    def name(self, file_path: str) -> str:
+        if self.root:
+            relative_path = os.path.relpath(file_path, self.root)
+            if not relative_path.startswith(os.pardir):
+                return Path(relative_path).as_posix()
+        return os.path.basename(file_path)
+
+source_names = SourceNames()
+
+def build_file_result(file_path: str, ocr_text: str, ocr_info: Optional[Dict[str, Any]], parser: Optional[OptimizedLabReportParser]) -> Dict[str, Any]:
+    if parser is None:
+        parser = get_parser()
+    if ocr_info and ocr_info.get('words') and zone_extractor.enabled:
+        result = zone_extractor.parse(ocr_text, ocr_info['words'], parser)
+    elif ocr_info and ocr_info.get('parsed'):
+        result = dict(ocr_info['parsed'])
+    else:
+        with timed_stage('parse'):
+            result = parser.parse_optimized(ocr_text)
+    with timed_stage('normalize'):
+        normalize_test_results([result], parser.test_catalog)
+    result['source_file'] = source_names.name(file_path)
+    if ocr_info:
+        result['ocrBackend'] = ocr_info['backend']
+        result['ocrCache'] = ocr_info['cache']
+        if 'textLayerScore' in ocr_info:
+            result['textLayerScore'] = ocr_info['textLayerScore']
+    result['success'] = True
+    return attach_metrics(result)
+
+def build_error_result(file_path: str, error: Exception, ocr_text: Optional[str] = None, parser: Optional[OptimizedLabReportParser] = None) -> Dict[str, Any]:
+    # Without OCR text no parse ran for this file, and the parser's thread-local patterns belong to an earlier job.
+    if ocr_text is None:
+        parser = None
+    return attach_metrics({
+        'source_file': source_names.name(file_path),
+        'error': str(error),
+        'success': False,
+        'debug': {
+            'ocr_length': len(ocr_text) if ocr_text else 0,
+            'failed_patterns': list(parser.failed_patterns) if parser else []
         }
+    })
+
+def read_text_file(file_path: str) -> str:
+    with timed_stage('read_file'):
+        with open(file_path, 'rb') as f:
+            content = f.read()
+    batch_checkpoint.note_content(file_path, content)
+    # Same newline handling as reading in text mode.
+    return content.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
 
-def process_batch_parallel(file_paths: List[str], max_workers: Optional[int] = None) -> List[Dict[str, Any]]:
-    if max_workers is None:
-        max_workers = min(len(file_paths), 3)
-    print(f'DEBUG: Processing {len(file_paths)} files with {max_workers} workers (Google Document AI)', file=sys.stderr)
+def load_ocr_text(file_path: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+    if file_path.endswith('.pdf'):
+        ocr_info = extract_pdf_text(file_path)
+        return ocr_info['text'], ocr_info
+    return read_text_file(file_path), None
+
+def process_single_file(file_path: str, parser: Optional[OptimizedLabReportParser] = None) -> Dict[str, Any]:
+    ocr_text = None
+    with collecting_metrics():
+        try:
+            ocr_text, ocr_info = load_ocr_text(file_path)
+            if parser is None:
+                parser = get_parser()
+            return build_file_result(file_path, ocr_text, ocr_info, parser)
+        except Exception as e:
+            return build_error_result(file_path, e, ocr_text, parser)
+
+def submit_bounded(executor: concurrent.futures.Executor, fn, items, limit: int) -> Iterator[Tuple[Any, concurrent.futures.Future]]:
+    # Keeps at most `limit` futures alive, so huge inputs are pulled lazily as earlier work completes.
+    pending = {}
+    for item in items:
+        pending[executor.submit(fn, item)] = item
+        if len(pending) >= limit:
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future
+    for future in concurrent.futures.as_completed(list(pending)):
+        yield pending.pop(future), future
+
+def process_batch_parallel(file_paths: Iterable[str], max_workers: Optional[int] = None, on_result=None) -> List[Dict[str, Any]]:
+    max_workers = max(1, max_workers or 3)
+    print(f'DEBUG: Processing files with {max_workers} workers (Google Document AI)', file=sys.stderr)
     start_time = time.time()
     results = []
     with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_file = {executor.submit(process_single_file, file_path): file_path for file_path in file_paths}
-        for future in concurrent.futures.as_completed(future_to_file):
+        for file_path, future in submit_bounded(executor, process_single_file, file_paths, max_workers * 2):
             try:
                 result = future.result()
-                results.append(result)
                 print(f'DEBUG: Completed {result.get("source_file", "unknown")}', file=sys.stderr)
             except Exception as e:
-                file_path = future_to_file[future]
-                results.append({
-                    'source_file': os.path.basename(file_path),
+                result = {
+                    'source_file': source_names.name(file_path),
                     'error': str(e),
                     'success': False
-                })
+                }
+            if on_result is None:
+                results.append(result)
+            else:
+                on_result(result)
+    total_time = time.time() - start_time
+    print(f'DEBUG: Batch processing completed in {total_time:.3f} seconds', file=sys.stderr)
+    return results
+
+def parse_in_worker(file_path: str, ocr_text: str, ocr_info: Optional[Dict[str, Any]], metrics_state: Optional[Tuple[Dict[str, float], Dict[str, int], float]] = None, template_path: Optional[str] = None, source_root: Optional[str] = None) -> Dict[str, Any]:
+    parser = get_parser()
+    # Spawned workers start with default settings, so the template and batch root travel with each job.
+    zone_extractor.template_path = template_path
+    source_names.root = source_root
+    with collecting_metrics(FileMetrics(*metrics_state) if metrics_state else None):
+        try:
+            return build_file_result(file_path, ocr_text, ocr_info, parser)
+        except Exception as e:
+            return build_error_result(file_path, e, ocr_text, parser)
+
+def process_batch_pipelined(file_paths: Iterable[str], io_workers: int = 3, parse_processes: Optional[int] = None, on_result=None) -> List[Dict[str, Any]]:
+    io_workers = max(1, io_workers)
+    parse_processes = max(1, parse_processes or os.cpu_count() or 1)
+    print(f'DEBUG: Pipelining files: {io_workers} OCR threads feeding {parse_processes} parse processes', file=sys.stderr)
+    start_time = time.time()
+    results = []
+    handoff = queue.Queue(maxsize=parse_processes * 2)
+    finished = object()
+    feed_errors = []
+    stop = threading.Event()
+
+    def emit(result: Dict[str, Any]) -> None:
+        print(f'DEBUG: Completed {result.get("source_file", "unknown")}', file=sys.stderr)
+        if on_result is None:
+            results.append(result)
+        else:
+            on_result(result)
+
+    def hand_off(item) -> None:
+        # Gives up once the consumer has stopped, so no OCR thread stays blocked on a full queue.
+        while not stop.is_set():
+            try:
+                handoff.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def load(file_path: str) -> None:
+        if stop.is_set():
+            return
+        with collecting_metrics() as metrics:
+            try:
+                ocr_text, ocr_info = load_ocr_text(file_path)
+                hand_off((file_path, ocr_text, ocr_info, metrics.state()))
+            except Exception as e:
+                hand_off(build_error_result(file_path, e))
+
+    def feed(io_executor: concurrent.futures.ThreadPoolExecutor) -> None:
+        try:
+            for _ in submit_bounded(io_executor, load, itertools.takewhile(lambda _: not stop.is_set(), file_paths), io_workers * 2):
+                pass
+        except Exception as e:
+            # Re-raised by the consumer once the files already handed off are drained.
+            feed_errors.append(e)
+        finally:
+            # Loads still in flight must reach the queue before the end marker does.
+            io_executor.shutdown(wait=True)
+            hand_off(finished)
+
+    # Spawned workers never inherit the gRPC threads running in the OCR stage.
+    parse_context = multiprocessing.get_context('spawn')
+    with concurrent.futures.ThreadPoolExecutor(max_workers=io_workers) as io_executor, \
+            concurrent.futures.ProcessPoolExecutor(max_workers=parse_processes, mp_context=parse_context) as parse_executor:
+        feeder = threading.Thread(target=feed, args=(io_executor,), daemon=True)
+        feeder.start()
+        pending = set()
+        try:
+            while True:
+                item = handoff.get()
+                if item is finished:
+                    break
+                if isinstance(item, dict):
+                    emit(item)
+                    continue
+                pending.add(parse_executor.submit(parse_in_worker, *item, zone_extractor.template_path, source_names.root))
+                if len(pending) >= parse_processes * 2:
+                    done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        emit(future.result())
+            for future in concurrent.futures.as_completed(pending):
+                emit(future.result())
+        finally:
+            # If emitting or a parse raised, unblock the OCR threads before the executors shut down.
+            stop.set()
+            for future in pending:
+                future.cancel()
+            while True:
+                try:
+                    handoff.get_nowait()
+                except queue.Empty:
+                    break
+            feeder.join()
+        if feed_errors:
+            raise feed_errors[0]
+    total_time = time.time() - start_time
+    print(f'DEBUG: Batch processing completed in {total_time:.3f} seconds', file=sys.stderr)
+    return results
+
+async def process_with_google_document_ai_async(client, name: str, label: str, pdf_content: bytes, bucket: TokenBucket, first_page: int = 0) -> str:
+    retries = 3
+    for attempt in range(retries):
+        with timed_stage('rate_limit_wait'):
+            await bucket.acquire_async()
+        try:
+            print(f'DEBUG: Processing {label} with Google Document AI (async)...', file=sys.stderr)
+            request = documentai.ProcessRequest(
+                name=name,
+                raw_document=documentai.RawDocument(
+                    content=pdf_content,
+                    mime_type='application/pdf'
+                ),
+            )
+            count_event('document_ai_calls')
+            with timed_stage('document_ai'):
+                result = await client.process_document(request=request, retry=document_ai_retry('AsyncRetry'))
+            record_layout(result.document, first_page)
+            extracted_text = result.document.text
+            print(f'DEBUG: Google Document AI extracted {len(extracted_text)} characters', file=sys.stderr)
+            return extracted_text
+        except exceptions.ResourceExhausted:
+            print(f'DEBUG: Quota exhausted for {label}, waiting for the rate limiter', file=sys.stderr)
+            bucket.drain()
+            if attempt == retries - 1:
+                raise
+            count_event('retries')
+
+async def extract_pdf_text_async(client, name: Optional[str], pdf_path: str, bucket: TokenBucket) -> Dict[str, Any]:
+    pdf_content, cache_key, cached = read_pdf_and_check_cache(pdf_path)
+    if cached:
+        return await asyncio.to_thread(zone_extractor.attach_words, cached, pdf_content)
+    cache_status = 'miss' if cache_key else 'disabled'
+    with timed_stage('text_layer'):
+        text_layer_info = await asyncio.to_thread(text_layer.try_parse, pdf_path, pdf_content)
+    if text_layer_info:
+        text_layer_info['cache'] = cache_status
+        return await asyncio.to_thread(zone_extractor.attach_words, text_layer_info, pdf_content)
+    with collecting_layout(zone_extractor.enabled) as layout:
+        try:
+            if client is None:
+                raise RuntimeError('Document AI client is not available')
+            label = os.path.basename(pdf_path)
+            with timed_stage('minimize'):
+                upload_content = await asyncio.to_thread(pdf_minimizer.minimize, pdf_content, label)
+            with timed_stage('page_split'):
+                page_ranges = await asyncio.to_thread(page_splitter.split, upload_content)
+            if len(page_ranges) > 1:
+                print(f'DEBUG: Split {label} into {len(page_ranges)} page ranges', file=sys.stderr)
+                text = join_page_texts(await asyncio.gather(*(
+                    process_with_google_document_ai_async(client, name, f'{label} ({pages})', content, bucket, index * page_splitter.pages_per_chunk)
+                    for index, (pages, content) in enumerate(page_ranges)
+                )))
+            else:
+                text = await process_with_google_document_ai_async(client, name, label, upload_content, bucket)
+        except Exception as e:
+            if is_resource_exhausted(e):
+                raise
+            print(f'DEBUG: Google Document AI failed: {e}, falling back to local extraction', file=sys.stderr)
+            count_event('fallbacks')
+            with timed_stage('local_fallback'):
+                text = await asyncio.to_thread(extract_text_from_pdf_local, pdf_path, pdf_content)
+            return await asyncio.to_thread(zone_extractor.attach_words, {'text': text, 'backend': 'local_fallback', 'cache': cache_status}, pdf_content)
+    store_in_cache(cache_key, text, 'document_ai', pdf_path)
+    return await asyncio.to_thread(zone_extractor.attach_words, {'text': text, 'backend': 'document_ai', 'cache': cache_status}, pdf_content, layout)
+
+async def process_single_file_async(file_path: str, client, name: Optional[str], bucket: TokenBucket, parser: OptimizedLabReportParser) -> Dict[str, Any]:
+    ocr_text = None
+    with collecting_metrics():
+        try:
+            ocr_info = None
+            if file_path.endswith('.pdf'):
+                ocr_info = await extract_pdf_text_async(client, name, file_path, bucket)
+                ocr_text = ocr_info['text']
+            else:
+                ocr_text = read_text_file(file_path)
+            return build_file_result(file_path, ocr_text, ocr_info, parser)
+        except Exception as e:
+            return build_error_result(file_path, e, ocr_text, parser)
+
+async def process_batch_async(file_paths: Iterable[str], requests_per_minute: float = DOCUMENT_AI_REQUESTS_PER_MINUTE, max_in_flight: int = 16, on_result=None) -> List[Dict[str, Any]]:
+    max_in_flight = max(1, max_in_flight)
+    print(f'DEBUG: Processing files with asyncio ({requests_per_minute:g} requests/minute, {max_in_flight} in flight)', file=sys.stderr)
+    start_time = time.time()
+    bucket = TokenBucket(requests_per_minute)
+    parser = get_parser()
+    client_state = {}
+    results = []
+
+    def document_ai_client() -> Tuple[Any, Optional[str]]:
+        # Created on the first PDF so text-only batches never build a channel.
+        if not client_state:
+            client_state['client'], client_state['name'] = None, None
+            try:
+                client = document_ai_pool.create_async_client()
+                client_state['client'] = client
+                client_state['name'] = client.processor_path(DOCUMENT_AI_PROJECT_ID, DOCUMENT_AI_LOCATION, DOCUMENT_AI_PROCESSOR_ID)
+            except Exception as e:
+                print(f'DEBUG: Could not create async Document AI client: {e}', file=sys.stderr)
+        return client_state['client'], client_state['name']
+
+    def start(file_path: str):
+        client, name = document_ai_client() if file_path.endswith('.pdf') else (None, None)
+        return asyncio.ensure_future(process_single_file_async(file_path, client, name, bucket, parser))
+
+    pending_paths = iter(file_paths)
+    pending = set()
+    try:
+        while True:
+            # Only max_in_flight files are open at once; the rest of the input is not read yet.
+            for file_path in itertools.islice(pending_paths, max_in_flight - len(pending)):
+                pending.add(start(file_path))
+            if not pending:
+                break
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                result = task.result()
+                print(f'DEBUG: Completed {result.get("source_file", "unknown")}', file=sys.stderr)
+                if on_result is None:
+                    results.append(result)
+                else:
+                    on_result(result)
+    finally:
+        for task in pending:
+            task.cancel()
+        if client_state.get('client') is not None:
+            await client_state['client'].transport.close()
     total_time = time.time() - start_time
     print(f'DEBUG: Batch processing completed in {total_time:.3f} seconds', file=sys.stderr)
     return results
 
+BATCH_FILE_PATTERNS = ['*.pdf', '*.txt']
+SCHEDULES = ['size', 'pages', 'none']
+
+def matches_any(name: str, relative_path: str, patterns: List[str]) -> bool:
+    return any(fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(relative_path, pattern) for pattern in patterns)
+
+def iter_batch_files(batch_dir: str, recursive: bool = False, include: Optional[List[str]] = None, exclude: Optional[List[str]] = None) -> Iterator[str]:
+    # Patterns match either the file name or its path relative to batch_dir; hidden entries are skipped.
+    include = include or BATCH_FILE_PATTERNS
+    exclude = exclude or []
+    directories = [batch_dir]
+    while directories:
+        directory = directories.pop()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir():
+                    if recursive:
+                        directories.append(entry.path)
+                    continue
+                relative_path = Path(os.path.relpath(entry.path, batch_dir)).as_posix()
+                if entry.is_file() and matches_any(entry.name, relative_path, include) and not matches_any(entry.name, relative_path, exclude):
+                    yield entry.path
+
+def file_page_count(file_path: str) -> int:
+    if not file_path.endswith('.pdf'):
+        return 1
+    with open(file_path, 'rb') as f:
+        pdf_content = f.read()
+    for backend in local_pdf_extractor.backends:
+        try:
+            return count_pdf_pages(pdf_content, backend)
+        except Exception:
+            continue
+    return 1
+
+def schedule_files(file_paths: Iterable[str], schedule: str) -> Iterable[str]:
+    # Longest first: big files start early instead of becoming the tail of the batch.
+    # Only paths are held for sorting; 'none' streams them straight into the engine.
+    if schedule == 'none':
+        return file_paths
+    if schedule == 'pages':
+        keyed = [((file_page_count(file_path), os.path.getsize(file_path)), file_path) for file_path in file_paths]
+    else:
+        keyed = [(os.path.getsize(file_path), file_path) for file_path in file_paths]
+    keyed.sort(key=lambda item: item[0], reverse=True)
+    print(f'DEBUG: Scheduled {len(keyed)} files largest first by {schedule}', file=sys.stderr)
+    return [file_path for _, file_path in keyed]
+
+def run_batch(file_paths: Iterable[str], args, on_result=None) -> List[Dict[str, Any]]:
+    if args.engine == 'async':
+        return asyncio.run(process_batch_async(file_paths, args.rpm, args.max_in_flight, on_result))
+    if args.engine == 'pipeline':
+        return process_batch_pipelined(file_paths, args.workers, args.parse_processes, on_result)
+    return process_batch_parallel(file_paths, args.workers, on_result)
+
+class NdjsonWriter:
+    def __init__(self, output_file: Optional[str] = None):
+        self._file = open(output_file, 'wb') if output_file else None
+        self._stream = self._file or sys.stdout.buffer
+        self.count = 0
+
+    def write(self, result: Dict[str, Any]) -> None:
+        metrics_sink.observe(result)
+        start_time = time.perf_counter()
+        self._stream.write((json.dumps(result, ensure_ascii=False) + '\n').encode('utf-8'))
+        self._stream.flush()
+        metrics_sink.add_batch_time('serialize', time.perf_counter() - start_time)
+        self.count += 1
+
+    def close(self) -> None:
+        if self._file:
+            self._file.close()
+
+MSGPACK_FORMAT_VERSION = 1
+MSGPACK_BLOCK_SIZE = 256
+TEST_RESULT_FIELDS = ['category', 'testName', 'result', 'flag', 'unit', 'referenceRange', 'resultValue', 'referenceLow', 'referenceHigh', 'flagComputed']
+INTERNED_TEST_FIELDS = ['category', 'testName', 'flag', 'unit', 'referenceRange', 'flagComputed']
+
+# --output-format msgpack reader contract (version 1):
+#   The output is a sequence of MessagePack maps (read with msgpack.Unpacker(stream, raw=False)).
+#   The first is a header: {"format": "clinex-results", "version": 1, "layout": "rows" | "columns",
+#   "testFields": [...], "internedFields": [...]}. Every following map has "strings": values to append, in order,
+#   to one string table shared by the whole stream. Test fields named in internedFields hold an index into that
+#   table (or nil); all other fields hold their value.
+#     rows:    {"strings": [...], "result": {...}}, one per file as it completes; result["testResults"] is a list
+#              of arrays in testFields order.
+#     columns: {"strings": [...], "results": [...], "tests": {field: [...]}}, one per --msgpack-block files;
+#              each result's "testResults" is its row count and its rows follow the previous result's in the columns.
+#   Results are otherwise identical to the JSON output; iter_msgpack_results() is the reference reader.
+class MsgpackWriter:
+    def __init__(self, output_file: Optional[str] = None, layout: str = 'rows', block_size: int = MSGPACK_BLOCK_SIZE):
+        try:
+            import msgpack
+        except ImportError:
+            raise RuntimeError('--output-format msgpack needs the msgpack package (pip install msgpack)')
+        self._packer = msgpack.Packer(use_bin_type=True)
+        self._file = open(output_file, 'wb') if output_file else None
+        self._stream = self._file or sys.stdout.buffer
+        self.layout = layout
+        self.block_size = max(1, block_size)
+        self._fields = [(field, field in INTERNED_TEST_FIELDS) for field in TEST_RESULT_FIELDS]
+        self._strings = {}
+        self._new_strings = []
+        self._block = []
+        self.count = 0
+        self._emit({
+            'format': 'clinex-results',
+            'version': MSGPACK_FORMAT_VERSION,
+            'layout': layout,
+            'testFields': TEST_RESULT_FIELDS,
+            'internedFields': INTERNED_TEST_FIELDS
+        })
+
+    def _intern(self, value: Optional[str]) -> Optional[int]:
+        if value is None:
+            return None
+        index = self._strings.get(value)
+        if index is None:
+            index = self._strings[value] = len(self._strings)
+            self._new_strings.append(value)
+        return index
+
+    def _take_strings(self) -> List[str]:
+        strings, self._new_strings = self._new_strings, []
+        return strings
+
+    def _emit(self, message: Dict[str, Any]) -> None:
+        self._stream.write(self._packer.pack(message))
+        self._stream.flush()
+
+    def _flush_block(self) -> None:
+        if not self._block:
+            return
+        results = []
+        columns = {field: [] for field in TEST_RESULT_FIELDS}
+        for result in self._block:
+            encoded = dict(result)
+            if 'testResults' in result:
+                encoded['testResults'] = len(result['testResults'])
+                for row in result['testResults']:
+                    for field, interned in self._fields:
+                        columns[field].append(self._intern(row.get(field)) if interned else row.get(field))
+            results.append(encoded)
+        self._block = []
+        self._emit({'strings': self._take_strings(), 'results': results, 'tests': columns})
+
+    def write(self, result: Dict[str, Any]) -> None:
+        metrics_sink.observe(result)
+        start_time = time.perf_counter()
+        if self.layout == 'rows':
+            encoded = dict(result)
+            if 'testResults' in result:
+                encoded['testResults'] = [
+                    [self._intern(row.get(field)) if interned else row.get(field) for field, interned in self._fields]
+                    for row in result['testResults']
+                ]
+            self._emit({'strings': self._take_strings(), 'result': encoded})
+        else:
+            self._block.append(result)
+            if len(self._block) >= self.block_size:
+                self._flush_block()
+        metrics_sink.add_batch_time('serialize', time.perf_counter() - start_time)
+        self.count += 1
+
+    def close(self) -> None:
+        start_time = time.perf_counter()
+        self._flush_block()
+        metrics_sink.add_batch_time('serialize', time.perf_counter() - start_time)
+        if self._file:
+            self._file.close()
+
+def iter_msgpack_results(stream) -> Iterator[Dict[str, Any]]:
+    import msgpack
+    unpacker = msgpack.Unpacker(stream, raw=False)
+    header = next(unpacker, None)
+    if not isinstance(header, dict) or header.get('format') != 'clinex-results' or header.get('version') != MSGPACK_FORMAT_VERSION:
+        raise ValueError('Not a version 1 clinex-results MessagePack stream')
+    fields = header['testFields']
+    interned = [field in header['internedFields'] for field in fields]
+    strings = []
+
+    def decode(values: List[Any]) -> Dict[str, Any]:
+        return {field: strings[value] if is_interned and value is not None else value for field, is_interned, value in zip(fields, interned, values)}
+
+    for message in unpacker:
+        strings.extend(message['strings'])
+        if 'result' in message:
+            result = message['result']
+            if 'testResults' in result:
+                result['testResults'] = [decode(row) for row in result['testResults']]
+            yield result
+            continue
+        rows = zip(*(message['tests'][field] for field in fields))
+        for result in message['results']:
+            if 'testResults' in result:
+                result['testResults'] = [decode(next(rows)) for _ in range(result['testResults'])]
+            yield result
+
+REPARSE_CHUNK_SIZE = 64
+
+def find_stored_ocr_files(source: str) -> List[str]:
+    if os.path.isfile(source):
+        return [source]
+    found = []
+    for root, _, names in os.walk(source):
+        found.extend(os.path.join(root, name) for name in names if name.endswith(('.txt', '.json')))
+    return sorted(found)
+
+def load_stored_ocr_text(file_path: str) -> Tuple[str, str, Optional[str]]:
+    with open(file_path, 'r', encoding='utf-8') as f:
+        if not file_path.endswith('.json'):
+            return source_names.name(file_path), f.read(), None
+        entry = json.load(f)
+    if not isinstance(entry, dict) or 'text' not in entry:
+        raise ValueError('Not an OCR cache entry')
+    return entry.get('sourceFile') or source_names.name(file_path)[:-5], entry['text'], entry.get('backend')
+
+def reparse_chunk(file_paths: List[str], source_root: Optional[str] = None) -> List[Dict[str, Any]]:
+    parser = get_parser()
+    # Spawned workers start with default settings, so the source directory travels with each chunk.
+    source_names.root = source_root
+    results = []
+    for file_path in file_paths:
+        try:
+            source_file, ocr_text, backend = load_stored_ocr_text(file_path)
+            result = parser.parse_optimized(ocr_text)
+            result['source_file'] = source_file
+            if backend:
+                result['ocrBackend'] = backend
+            result['success'] = True
+        except Exception as e:
+            result = build_error_result(file_path, e)
+        results.append(result)
+    normalize_test_results([result for result in results if result['success']], parser.test_catalog)
+    return results
+
+def load_previous_results(path: str) -> Dict[str, Dict[str, Any]]:
+    with open(path, 'rb') as f:
+        content = f.read()
+    if content[:1] not in (b'', b'[', b'{', b' ', b'\n', b'\r', b'\t'):
+        results = list(iter_msgpack_results(io.BytesIO(content)))
+    elif content.lstrip().startswith(b'['):
+        results = json.loads(content)
+    else:
+        results = [json.loads(line) for line in content.splitlines() if line.strip()]
+    previous = {}
+    for result in results:
+        name = result.get('source_file')
+        if name and result.get('success'):
+            previous[name] = result
+            # Archived text is usually named after its PDF, so also match on the stem.
+            previous.setdefault(os.path.splitext(name)[0], result)
+    return previous
+
+def diff_results(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, List[Any]]:
+    changes = {}
+    for section in ('patientInfo', 'labInfo'):
+        old_section, new_section = old.get(section) or {}, new.get(section) or {}
+        for field in sorted(set(old_section) | set(new_section)):
+            if old_section.get(field) != new_section.get(field):
+                changes[f'{section}.{field}'] = [old_section.get(field), new_section.get(field)]
+    old_tests = {(test['category'], test['testName']): test for test in old.get('testResults') or []}
+    new_tests = {(test['category'], test['testName']): test for test in new.get('testResults') or []}
+    # Zone-template rows above the first category heading have no category.
+    for key in sorted(set(old_tests) | set(new_tests), key=lambda k: (k[0] or '', k[1])):
+        path = f'testResults.{key[0] or ""}/{key[1]}'
+        old_test, new_test = old_tests.get(key), new_tests.get(key)
+        if old_test is None or new_test is None:
+            changes[path] = [old_test, new_test]
+            continue
+        for field in ('result', 'flag', 'unit', 'referenceRange'):
+            if old_test.get(field) != new_test.get(field):
+                changes[f'{path}.{field}'] = [old_test.get(field), new_test.get(field)]
+    return changes
+
+def summarize_change(path: str, change: List[Any]) -> str:
+    if not path.startswith('testResults.'):
+        return path
+    if isinstance(change[1], dict) and change[0] is None:
+        return 'testResults (added)'
+    if isinstance(change[0], dict) and change[1] is None:
+        return 'testResults (removed)'
+    return 'testResults.' + path.rsplit('.', 1)[1]
+
+def reparse_stored_ocr(source: str, previous_path: Optional[str] = None, processes: Optional[int] = None, on_result=None) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    file_paths = find_stored_ocr_files(source)
+    if not file_paths:
+        raise Exception(f'No OCR text or cache entries found in {source}')
+    processes = max(1, processes or os.cpu_count() or 1)
+    previous = load_previous_results(previous_path) if previous_path else None
+    # Name results relative to the source directory, as --batch --recursive does, so nested files keep distinct names.
+    source_root = source if os.path.isdir(source) else None
+    print(f'DEBUG: Re-parsing {len(file_paths)} stored OCR files with {processes} processes', file=sys.stderr)
+    start_time = time.time()
+    results = []
+    field_changes = {}
+    summary = {'files': 0, 'errors': 0, 'changed': 0, 'unchanged': 0, 'noPrevious': 0}
+    chunks = [file_paths[i:i + REPARSE_CHUNK_SIZE] for i in range(0, len(file_paths), REPARSE_CHUNK_SIZE)]
+
+    def emit(result: Dict[str, Any]) -> None:
+        summary['files'] += 1
+        if not result.get('success'):
+            summary['errors'] += 1
+        elif previous is not None:
+            old = previous.get(result['source_file']) or previous.get(os.path.splitext(result['source_file'])[0])
+            if old is None:
+                summary['noPrevious'] += 1
+            else:
+                result['changes'] = diff_results(old, result)
+                summary['changed' if result['changes'] else 'unchanged'] += 1
+                for path, change in result['changes'].items():
+                    field = summarize_change(path, change)
+                    field_changes[field] = field_changes.get(field, 0) + 1
+        if on_result is None:
+            results.append(result)
+        else:
+            on_result(result)
+
+    parse_context = multiprocessing.get_context('spawn')
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes, mp_context=parse_context) as executor:
+        pending = set()
+        for chunk in chunks:
+            pending.add(executor.submit(reparse_chunk, chunk, source_root))
+            if len(pending) >= processes * 2:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    for result in future.result():
+                        emit(result)
+        for future in concurrent.futures.as_completed(pending):
+            for result in future.result():
+                emit(result)
+    summary['fieldChanges'] = dict(sorted(field_changes.items(), key=lambda item: -item[1]))
+    total_time = time.time() - start_time
+    print(f'DEBUG: Re-parsed {summary["files"]} files in {total_time:.3f} seconds ({summary["files"] / max(total_time, 1e-9):.0f}/s)', file=sys.stderr)
+    if previous is not None:
+        print(f'DEBUG: {summary["changed"]} changed, {summary["unchanged"]} unchanged, {summary["noPrevious"]} without previous output', file=sys.stderr)
+        for field, count in summary['fieldChanges'].items():
+            print(f'DEBUG:   {field}: {count}', file=sys.stderr)
+    return results, summary
+
+CHECKPOINT_FILENAME = '.ocr_checkpoint.jsonl'
+
+def file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class BatchCheckpoint:
+    # Files are hashed from the bytes their read stage already holds; only --resume reads a file just to hash it.
+    def __init__(self, manifest_path: Optional[str] = None):
+        self.manifest_path = manifest_path
+        self.hashes = {}
+        self.completed = {}
+        self.resuming = False
+        self._torn_tail = False
+        self._file = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self._file is not None
+
+    @staticmethod
+    def key(file_path: str) -> str:
+        return source_names.name(file_path)
+
+    def load(self) -> None:
+        if not os.path.exists(self.manifest_path):
+            return
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                self._torn_tail = not line.endswith('\n')
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash mid-append can leave one torn line at the end.
+                    continue
+                self.completed[entry['file']] = entry
+
+    def open(self, resume: bool) -> None:
+        self.resuming = resume
+        if resume:
+            self.load()
+        self._file = open(self.manifest_path, 'a' if resume else 'w', encoding='utf-8')
+        if self._torn_tail:
+            # The previous run died mid-write; start the next entry on a fresh line.
+            self._file.write('\n')
+
+    def note_content(self, file_path: str, content: bytes) -> None:
+        if not self.enabled:
+            return
+        digest = hashlib.sha256(content).hexdigest()
+        with self._lock:
+            self.hashes[self.key(file_path)] = digest
+
+    def stored_result(self, file_path: str) -> Optional[Dict[str, Any]]:
+        if not self.resuming:
+            return None
+        entry = self.completed.get(self.key(file_path))
+        if entry is None or entry['sha256'] != file_sha256(file_path):
+            return None
+        return dict(entry['result'], resumed=True)
+
+    def record(self, result: Dict[str, Any]) -> None:
+        name = result.get('source_file')
+        with self._lock:
+            digest = self.hashes.pop(name, None)
+        if not result.get('success') or digest is None:
+            return
+        line = json.dumps({'file': name, 'sha256': digest, 'result': result}, ensure_ascii=False) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        if self._file:
+            self._file.close()
+            self._file = None
+
+batch_checkpoint = BatchCheckpoint()
+
+def run_checkpointed_batch(file_paths: Iterable[str], args, checkpoint: BatchCheckpoint, on_result=None) -> List[Dict[str, Any]]:
+    results = []
+    emit_lock = threading.Lock()
+    resumed = 0
+
+    def emit(result: Dict[str, Any]) -> None:
+        # Replayed results are emitted from whichever thread pulls the next path.
+        with emit_lock:
+            if on_result is None:
+                results.append(result)
+            else:
+                on_result(result)
+
+    def pending_files() -> Iterator[str]:
+        nonlocal resumed
+        for file_path in file_paths:
+            stored = checkpoint.stored_result(file_path)
+            if stored is None:
+                yield file_path
+            else:
+                emit(stored)
+                resumed += 1
+
+    def record(result: Dict[str, Any]) -> None:
+        checkpoint.record(result)
+        emit(result)
+
+    run_batch(pending_files(), args, record)
+    if resumed:
+        print(f'DEBUG: Resumed {resumed} completed files from {checkpoint.manifest_path}', file=sys.stderr)
+    return results
+
+def warm_up() -> OptimizedLabReportParser:
+    start_time = time.time()
+    parser = get_parser()
+    try:
+        with document_ai_pool.client():
+            pass
+    except Exception as e:
+        print(f'DEBUG: Document AI client warm-up failed: {e}, will retry on first PDF', file=sys.stderr)
+    print(f'DEBUG: Worker warmed up in {time.time() - start_time:.3f} seconds', file=sys.stderr)
+    return parser
+
+def decode_serve_request(line: str) -> Dict[str, Any]:
+    try:
+        request = json.loads(line)
+    except json.JSONDecodeError as e:
+        return {'command': 'invalid', 'error': f'Invalid request: {e}'}
+    if not isinstance(request, dict):
+        return {'command': 'invalid', 'error': 'Invalid request: expected a JSON object'}
+    return request
+
+def handle_serve_request(request: Dict[str, Any], parser: OptimizedLabReportParser) -> Dict[str, Any]:
+    command = request.get('command')
+    if command == 'invalid':
+        result = {'error': request['error'], 'success': False}
+    elif command == 'ping':
+        result = {'success': True, 'pong': True, 'cache': ocr_cache.stats()}
+    elif not request.get('file'):
+        result = {'error': 'Request is missing "file"', 'success': False}
+    else:
+        result = process_single_file(str(request['file']), parser)
+    if 'id' in request:
+        result['id'] = request['id']
+    return result
+
+def encode_serve_response(result: Dict[str, Any]) -> bytes:
+    return (json.dumps(result, ensure_ascii=False) + '\n').encode('utf-8')
+
+def serve_stdio(parser: OptimizedLabReportParser) -> None:
+    print('DEBUG: Serving JSON-line jobs on stdin/stdout', file=sys.stderr)
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        request = decode_serve_request(line)
+        if request.get('command') == 'shutdown':
+            break
+        sys.stdout.buffer.write(encode_serve_response(handle_serve_request(request, parser)))
+        sys.stdout.buffer.flush()
+
+class OcrRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for raw_line in self.rfile:
+            line = raw_line.decode('utf-8')
+            if not line.strip():
+                continue
+            request = decode_serve_request(line)
+            if request.get('command') == 'shutdown':
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+                return
+            self.wfile.write(encode_serve_response(handle_serve_request(request, self.server.parser)))
+            self.wfile.flush()
+
+class OcrSocketServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, parser: OptimizedLabReportParser):
+        try:
+            mode = os.lstat(socket_path).st_mode
+        except FileNotFoundError:
+            mode = None
+        if mode is not None:
+            if not stat.S_ISSOCK(mode):
+                raise Exception(f'{socket_path} exists and is not a socket')
+            # Left behind by a server that did not shut down cleanly.
+            os.unlink(socket_path)
+        self.parser = parser
+        super().__init__(socket_path, OcrRequestHandler)
+
+def serve_socket(socket_path: str, parser: OptimizedLabReportParser) -> None:
+    with OcrSocketServer(socket_path, parser) as server:
+        print(f'DEBUG: Serving JSON-line jobs on {socket_path}', file=sys.stderr)
+        try:
+            server.serve_forever()
+        finally:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+
 def main():
     parser = argparse.ArgumentParser(description='Parse lab report OCR text with Google Document AI')
     group = parser.add_mutually_exclusive_group(required=True)
     group.add_argument('--file', help='Single file to process')
     group.add_argument('--batch', help='Directory containing OCR files')
     group.add_argument('--file-list', help='Text file containing list of files to process')
-    parser.add_argument('--output-format', choices=['json', 'pretty'], default='json')
-    parser.add_argument('--workers', type=int, default=3, help='Number of parallel workers (max 3 for API limits)')
+    group.add_argument('--reparse', metavar='SOURCE', help='Re-run the parser over stored OCR text: a .txt corpus or an OCR cache directory (no OCR calls)')
+    group.add_argument('--serve', action='store_true', help='Stay resident and process JSON-line jobs ({"file": ...}) from stdin or --socket')
+    parser.add_argument('--recursive', action='store_true', help='Also scan subdirectories of --batch')
+    parser.add_argument('--include', action='append', help=f'Glob for --batch files to process, matched against the name or relative path (repeatable, default: {" ".join(BATCH_FILE_PATTERNS)})')
+    parser.add_argument('--exclude', action='append', help='Glob for --batch files to skip (repeatable)')
+    parser.add_argument('--schedule', choices=SCHEDULES, default='size', help='Start the largest files first by byte size or page count, or stream files in directory order without sorting (none)')
+    parser.add_argument('--output-format', choices=['json', 'pretty', 'ndjson', 'msgpack'], default='json', help='ndjson streams one result per line as each file completes; msgpack streams MessagePack with shared test-row strings')
+    parser.add_argument('--msgpack-layout', choices=['rows', 'columns'], default='rows', help='msgpack output: one message per file, or test rows as columns per block of --msgpack-block files')
+    parser.add_argument('--msgpack-block', type=int, default=MSGPACK_BLOCK_SIZE, help='Files per message in the columns layout')
+    parser.add_argument('--workers', type=int, default=3, help='Number of parallel workers (max 3 for API limits); also caps the Document AI channel pool')
     parser.add_argument('--output-file', help='Output file (default: stdout)')
+    parser.add_argument('--engine', choices=['threads', 'async', 'pipeline'], default='threads', help='Batch engine: thread pool capped by --workers, asyncio capped by --rpm, or --workers OCR threads feeding a parse process pool')
+    parser.add_argument('--parse-processes', type=int, default=None, help='Parse processes for the pipeline engine and --reparse (default: CPU count)')
+    parser.add_argument('--previous', help='Previous output (JSON array, NDJSON or msgpack) to diff --reparse results against, matched by source_file')
+    parser.add_argument('--diff-report', help='Write the --reparse change summary as JSON to this file')
+    parser.add_argument('--rpm', type=float, default=DOCUMENT_AI_REQUESTS_PER_MINUTE, help='Document AI requests per minute allowed by the async engine')
+    parser.add_argument('--max-in-flight', type=int, default=16, help='Maximum files held open concurrently by the async engine')
+    parser.add_argument('--document-ai-endpoint', default=DOCUMENT_AI_ENDPOINT, help='Send Document AI requests to this plaintext gRPC host:port instead of Google (env DOCUMENT_AI_ENDPOINT)')
+    parser.add_argument('--hedge', action='store_true', help='Send a duplicate Document AI request when a call outlasts --hedge-percentile of recent latencies (threads/pipeline engines)')
+    parser.add_argument('--hedge-percentile', type=float, default=95, help='Latency percentile after which a request is hedged')
+    parser.add_argument('--hedge-min-delay', type=float, default=1.0, help='Never hedge a request earlier than this many seconds')
+    parser.add_argument('--hedge-rpm', type=float, default=6, help='Quota budget for hedged requests per minute; hedging pauses after ResourceExhausted')
+    parser.add_argument('--split-pages', type=int, default=0, help='OCR PDFs longer than this many pages as concurrent page ranges of this size (0 = off)')
+    parser.add_argument('--split-workers', type=int, default=4, help='Concurrent page-range requests per process when --split-pages is set')
+    parser.add_argument('--minimize-pdf', action='store_true', help='Shrink PDFs before upload: downsample images, drop blank and duplicate pages, strip unused objects (needs PyMuPDF)')
+    parser.add_argument('--minimize-dpi', type=int, default=200, help='Downsample page images above this resolution to it')
+    parser.add_argument('--minimize-quality', type=int, default=75, help='JPEG quality for rewritten images (0-100)')
+    parser.add_argument('--minimize-keep-color', action='store_true', help='Keep colour instead of converting pages to grayscale')
+    parser.add_argument('--minimize-keep-pages', action='store_true', help='Never drop blank or duplicate pages')
+    parser.add_argument('--template', help='Zone template JSON (field zones and table column bands); fields are read from word boxes and the regex parser only fills what the zones miss')
+    parser.add_argument('--local-backends', default=','.join(LOCAL_PDF_BACKENDS), help='Comma-separated order of local PDF text backends (pymupdf, pdfplumber, pypdf2)')
+    parser.add_argument('--local-tables', action='store_true', help='Also append table rows during local PDF extraction (slower)')
+    parser.add_argument('--local-parallel-pages', type=int, default=0, help='Extract PDFs with at least this many pages across a process pool (default 0 = never; starting the pool costs about a second)')
+    parser.add_argument('--text-layer-first', action='store_true', help='Parse the embedded PDF text first and only call Document AI when it scores below --text-layer-threshold')
+    parser.add_argument('--text-layer-threshold', type=float, default=0.9, help='Minimum completeness score (0-1) for accepting the embedded text layer')
+    parser.add_argument('--cache-dir', default=OCR_CACHE_DIR, help='Directory for the content-addressed OCR result cache')
+    parser.add_argument('--cache-max-mb', type=int, default=OCR_CACHE_MAX_MB, help='Evict least recently used cache entries above this size')
+    parser.add_argument('--no-cache', action='store_true', help='Always call Document AI, bypassing the OCR cache')
+    parser.add_argument('--resume', action='store_true', help='Skip --batch files whose content matches a completed checkpoint entry and replay their stored results')
+    parser.add_argument('--checkpoint', help=f'Checkpoint manifest for --batch (default: {CHECKPOINT_FILENAME} in the batch directory)')
+    parser.add_argument('--no-checkpoint', action='store_true', help='Do not record completed --batch files')
+    parser.add_argument('--metrics-file', help='Write per-file stage timings and batch latency histograms to this file')
+    parser.add_argument('--metrics-format', choices=['jsonl', 'prometheus'], default='jsonl', help='JSON lines (one per file plus a batch summary) or a Prometheus textfile-collector file')
+    parser.add_argument('--socket', help='Unix socket path to listen on in --serve mode (default: stdin/stdout)')
     args = parser.parse_args()
     results = []
+    document_ai_pool.size = max(1, args.workers)
+    document_ai_pool.endpoint = args.document_ai_endpoint
+    request_hedger.enabled = args.hedge
+    request_hedger.percentile = args.hedge_percentile
+    request_hedger.min_delay = args.hedge_min_delay
+    request_hedger.configure_budget(args.hedge_rpm)
+    page_splitter.pages_per_chunk = max(0, args.split_pages)
+    page_splitter.max_workers = max(1, args.split_workers)
+    zone_extractor.template_path = args.template
+    if args.template:
+        load_zone_template(args.template)
+    pdf_minimizer.enabled = args.minimize_pdf
+    pdf_minimizer.target_dpi = args.minimize_dpi
+    pdf_minimizer.quality = args.minimize_quality
+    pdf_minimizer.grayscale = not args.minimize_keep_color
+    pdf_minimizer.drop_pages = not args.minimize_keep_pages
+    local_pdf_extractor.backends = [backend.strip() for backend in args.local_backends.split(',') if backend.strip()]
+    local_pdf_extractor.include_tables = args.local_tables
+    local_pdf_extractor.parallel_min_pages = max(0, args.local_parallel_pages)
+    text_layer.enabled = args.text_layer_first
+    text_layer.threshold = args.text_layer_threshold
+    ocr_cache.cache_dir = args.cache_dir
+    ocr_cache.max_bytes = args.cache_max_mb * 1024 * 1024
+    ocr_cache.enabled = not args.no_cache
+    metrics_sink.path = args.metrics_file
+    metrics_sink.output_format = args.metrics_format
+    writer = None
     try:
+        if args.serve:
+            lab_parser = warm_up()
+            if args.socket:
+                serve_socket(args.socket, lab_parser)
+            else:
+                serve_stdio(lab_parser)
+            return
+        if args.output_format == 'ndjson':
+            writer = NdjsonWriter(args.output_file)
+        elif args.output_format == 'msgpack':
+            writer = MsgpackWriter(args.output_file, args.msgpack_layout, args.msgpack_block)
+        on_result = writer.write if writer else None
         if args.file:
             result = process_single_file(args.file)
-            results = [result]
+            if writer:
+                writer.write(result)
+            else:
+                results = [result]
         elif args.batch:
             batch_dir = Path(args.batch)
-            file_paths = []
-            file_paths.extend([str(f) for f in batch_dir.glob('*.pdf')])
-            file_paths.extend([str(f) for f in batch_dir.glob('*.txt')])
-            print(f'DEBUG: Found {len(file_paths)} files to process', file=sys.stderr)
-            if not file_paths:
-                raise Exception(f'No PDF or TXT files found in {batch_dir}')
-            results = process_batch_parallel(file_paths, args.workers)
+            source_names.root = args.batch
+            found = iter_batch_files(args.batch, args.recursive, args.include, args.exclude)
+            first = next(found, None)
+            if first is None:
+                raise Exception(f'No files matching {", ".join(args.include or BATCH_FILE_PATTERNS)} found in {batch_dir}')
+            file_paths = schedule_files(itertools.chain([first], found), args.schedule)
+            if args.no_checkpoint:
+                results = run_batch(file_paths, args, on_result)
+            else:
+                batch_checkpoint.manifest_path = args.checkpoint or str(batch_dir / CHECKPOINT_FILENAME)
+                batch_checkpoint.open(args.resume)
+                results = run_checkpointed_batch(file_paths, args, batch_checkpoint, on_result)
+        elif args.reparse:
+            results, summary = reparse_stored_ocr(args.reparse, args.previous, args.parse_processes, on_result)
+            if args.diff_report:
+                with open(args.diff_report, 'w', encoding='utf-8') as f:
+                    json.dump(summary, f, ensure_ascii=False, indent=2)
         elif args.file_list:
             with open(args.file_list, 'r') as f:
                 file_paths = [line.strip() for line in f if line.strip()]
-            results = process_batch_parallel(file_paths, args.workers)
+            results = run_batch(schedule_files(file_paths, args.schedule), args, on_result)
+        report_cache_stats()
+        if writer:
+            return
+        for result in results:
+            metrics_sink.observe(result)
+        start_time = time.perf_counter()
         if args.output_format == 'json':
             output = json.dumps(results, ensure_ascii=False)
         else:
             output = json.dumps(results, ensure_ascii=False, indent=2)
+        metrics_sink.add_batch_time('serialize', time.perf_counter() - start_time)
         if args.output_file:
             with open(args.output_file, 'w', encoding='utf-8') as f:
                 f.write(output)
@@ -567,6 +2636,11 @@ def main():
         error_msg = f'Error: {e}'
         sys.stderr.buffer.write(error_msg.encode('utf-8'))
         sys.exit(1)
+    finally:
+        if writer:
+            writer.close()
+        batch_checkpoint.close()
+        metrics_sink.close()
 
 if __name__ == '__main__':
     main()
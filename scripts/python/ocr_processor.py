@@ -1,52 +1,139 @@
 import sys
 import os
+import shutil
+import argparse
+import concurrent.futures
+from collections import deque
 import pytesseract
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
 
-pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+PAGE_BREAK = "\n--- PAGE BREAK ---\n"
+DEFAULT_DPI = 200
 
-def extract_text_from_pdf(pdf_path):
+# Binaries come from the environment or PATH; the Windows install locations are only a last resort.
+WINDOWS_TESSERACT_CMD = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+WINDOWS_POPPLER_PATH = r'C:\poppler\Library\bin'
+
+
+def find_tesseract_cmd():
+    """
+    Returns the Tesseract executable from TESSERACT_CMD, PATH, or the default Windows install.
+    """
+    cmd = os.environ.get('TESSERACT_CMD') or shutil.which('tesseract')
+    if not cmd and os.name == 'nt' and os.path.exists(WINDOWS_TESSERACT_CMD):
+        cmd = WINDOWS_TESSERACT_CMD
+    return cmd or 'tesseract'
+
+
+def find_poppler_path():
+    """
+    Returns the Poppler bin directory from POPPLER_PATH, or None to let pdf2image use PATH.
+    """
+    path = os.environ.get('POPPLER_PATH')
+    if not path and os.name == 'nt' and not shutil.which('pdftoppm') and os.path.isdir(WINDOWS_POPPLER_PATH):
+        path = WINDOWS_POPPLER_PATH
+    return path or None
+
+
+pytesseract.pytesseract.tesseract_cmd = find_tesseract_cmd()
+# Each Tesseract process stays single-threaded; parallelism comes from running one per page.
+os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+
+
+def count_pages(pdf_path, poppler_path=None):
+    return int(pdfinfo_from_path(pdf_path, poppler_path=poppler_path)['Pages'])
+
+
+def ocr_page(pdf_path, page_number, dpi=DEFAULT_DPI, grayscale=True, lang=None, config='', poppler_path=None):
+    """
+    Renders a single page and runs Tesseract on it, so only this page's image is held in memory.
+    """
+    images = convert_from_path(
+        pdf_path,
+        dpi=dpi,
+        first_page=page_number,
+        last_page=page_number,
+        grayscale=grayscale,
+        poppler_path=poppler_path,
+    )
+    try:
+        return pytesseract.image_to_string(images[0], lang=lang, config=config) if images else ""
+    finally:
+        for image in images:
+            image.close()
+
+
+def iter_page_texts(pdf_path, dpi=DEFAULT_DPI, grayscale=True, workers=None, lang=None, config='', poppler_path=None):
+    """
+    Yields (page_number, text) in page order while OCRing up to `workers` pages at once.
+
+    Rendering and Tesseract both run as subprocesses, so threads are enough to keep every core
+    busy; at most `workers` page images exist at any time.
+    """
+    workers = max(1, workers or os.cpu_count() or 1)
+    page_count = count_pages(pdf_path, poppler_path)
+    print(f"Python Log: PDF has {page_count} page(s), OCR with {workers} worker(s) at {dpi} DPI.", file=sys.stderr)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        next_page = 1
+        while pending or next_page <= page_count:
+            while next_page <= page_count and len(pending) < workers:
+                pending.append((next_page, executor.submit(
+                    ocr_page, pdf_path, next_page, dpi, grayscale, lang, config, poppler_path
+                )))
+                next_page += 1
+            page_number, future = pending.popleft()
+            text = future.result()
+            print(f"Python Log: Page {page_number}/{page_count} done.", file=sys.stderr)
+            yield page_number, text
+
+
+def extract_text_from_pdf(pdf_path, dpi=DEFAULT_DPI, grayscale=True, workers=None, lang=None, config=''):
     """
     Extracts text from all pages of a PDF file and returns it as a single string.
     """
     absolute_pdf_path = os.path.abspath(pdf_path)
-    # --- NEW DEBUG LOGGING ---
     print(f"Python Log: Script started. Attempting to process '{absolute_pdf_path}'.", file=sys.stderr)
 
     try:
-        # This points to your Poppler installation
-        images = convert_from_path(absolute_pdf_path, poppler_path=r'C:\poppler\Library\bin') 
-
-        # --- NEW DEBUG LOGGING ---
-        print(f"Python Log: PDF successfully converted into {len(images)} image(s).", file=sys.stderr)
-
-        full_text = ""
-
-        # Loop through each page image and perform OCR
-        for i, image in enumerate(images):
-            # --- NEW DEBUG LOGGING ---
-            print(f"Python Log: Processing page {i + 1} with OCR...", file=sys.stderr)
-            
-            # You can add configuration options here if needed, for example:
-            # custom_config = r'--oem 3 --psm 6'
-            # text = pytesseract.image_to_string(image, config=custom_config)
-            
-            text = pytesseract.image_to_string(image)
-            full_text += text + "\n--- PAGE BREAK ---\n"
-
-        # --- NEW DEBUG LOGGING ---
-        print("Python Log: OCR complete. Returning text to Laravel.", file=sys.stderr)
-        return full_text
-
+        pages = iter_page_texts(absolute_pdf_path, dpi, grayscale, workers, lang, config, find_poppler_path())
+        return "".join(text + PAGE_BREAK for _, text in pages)
     except Exception as e:
         print(f"Python Error: {e}", file=sys.stderr)
         return None
 
+
+def stream_text_from_pdf(pdf_path, out=sys.stdout, dpi=DEFAULT_DPI, grayscale=True, workers=None, lang=None, config=''):
+    """
+    Writes each page's text to `out` as soon as it and all earlier pages are done.
+    """
+    absolute_pdf_path = os.path.abspath(pdf_path)
+    print(f"Python Log: Script started. Attempting to process '{absolute_pdf_path}'.", file=sys.stderr)
+
+    try:
+        for _, text in iter_page_texts(absolute_pdf_path, dpi, grayscale, workers, lang, config, find_poppler_path()):
+            out.write(text + PAGE_BREAK)
+            out.flush()
+        out.write("\n")
+        print("Python Log: OCR complete. Returning text to Laravel.", file=sys.stderr)
+        return True
+    except Exception as e:
+        print(f"Python Error: {e}", file=sys.stderr)
+        return False
+
+
 if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        pdf_file_path = sys.argv[1]
-        extracted_text = extract_text_from_pdf(pdf_file_path)
-        if extracted_text:
-            print(extracted_text)
-    else:
-        print("Python Error: No PDF file path provided.", file=sys.stderr)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Offline OCR for scanned lab report PDFs')
+    parser.add_argument('pdf', nargs='?', help='Path to the PDF file')
+    parser.add_argument('--dpi', type=int, default=int(os.environ.get('OCR_DPI', DEFAULT_DPI)), help='Render resolution per page')
+    parser.add_argument('--color', action='store_true', help='Render pages in color instead of grayscale')
+    parser.add_argument('--workers', type=int, default=None, help='Pages to OCR concurrently (default: CPU count)')
+    parser.add_argument('--lang', default=os.environ.get('OCR_LANG'), help='Tesseract language(s), e.g. eng+khm')
+    parser.add_argument('--config', default='', help="Extra Tesseract options, e.g. '--oem 3 --psm 6'")
+    args = parser.parse_args()
+
+    if not args.pdf:
+        print("Python Error: No PDF file path provided.", file=sys.stderr)
+    elif not stream_text_from_pdf(args.pdf, sys.stdout, args.dpi, not args.color, args.workers, args.lang, args.config):
+        sys.exit(1)
@@ -0,0 +1,104 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import document_ocr
+
+class ComputedFlagTest(unittest.TestCase):
+    def parse(self, ocr_text):
+        parser = document_ocr.get_parser()
+        result = parser.parse_optimized(ocr_text)
+        document_ocr.normalize_test_results([result], parser.test_catalog)
+        return {row['testName']: row for row in result['testResults']}
+
+    def test_spaced_report_range_keeps_full_catalog_range(self):
+        rows = self.parse('HEMATOLOGY\nHGB 14.2 g/dL (12.0 - 16.0)\n')
+        self.assertEqual(rows['HGB']['referenceRange'], '(11.5-16.5)')
+        self.assertEqual((rows['HGB']['referenceLow'], rows['HGB']['referenceHigh']), (11.5, 16.5))
+        self.assertEqual(rows['HGB']['flagComputed'], 'N')
+
+    def test_normal_hematology_values_are_not_flagged(self):
+        rows = self.parse('HEMATOLOGY\nHGB 14.2 g/dL\nRBC 4.8 x1012/L\nMCV 88 fl\nMCH 29.5 pg\nMCHC 33.5 g/dL\n')
+        self.assertEqual({name: row['flagComputed'] for name, row in rows.items()},
+                         {'HGB': 'N', 'RBC': 'N', 'MCV': 'N', 'MCH': 'N', 'MCHC': 'N'})
+
+    def test_out_of_range_values_are_flagged(self):
+        rows = self.parse('HEMATOLOGY\nHGB 9.8 g/dL\nMCV 104 fl\n')
+        self.assertEqual(rows['HGB']['flagComputed'], 'L')
+        self.assertEqual(rows['MCV']['flagComputed'], 'H')
+
+class PipelinedBatchTest(unittest.TestCase):
+    def test_failing_result_sink_propagates_instead_of_hanging(self):
+        with tempfile.TemporaryDirectory() as batch_dir:
+            file_paths = []
+            for index in range(40):
+                file_paths.append(os.path.join(batch_dir, f'report_{index:03d}.txt'))
+                with open(file_paths[-1], 'w', encoding='utf-8') as f:
+                    f.write('HEMATOLOGY\nHGB 14.2 g/dL\n')
+            emitted = []
+
+            def sink(result):
+                emitted.append(result)
+                if len(emitted) == 3:
+                    raise BrokenPipeError('result sink closed')
+
+            errors = []
+
+            def run():
+                try:
+                    document_ocr.process_batch_pipelined(file_paths, 2, 1, on_result=sink)
+                except BrokenPipeError as e:
+                    errors.append(e)
+
+            runner = threading.Thread(target=run, daemon=True)
+            runner.start()
+            runner.join(timeout=60)
+            self.assertFalse(runner.is_alive(), 'pipelined batch hung after the result sink failed')
+            self.assertEqual(len(errors), 1)
+
+class ReparseTest(unittest.TestCase):
+    def test_nested_files_with_one_basename_keep_distinct_names(self):
+        with tempfile.TemporaryDirectory() as source:
+            os.mkdir(os.path.join(source, 'sub'))
+            for relative_path, hgb in (('report.txt', '14.2'), (os.path.join('sub', 'report.txt'), '9.8')):
+                with open(os.path.join(source, relative_path), 'w', encoding='utf-8') as f:
+                    f.write(f'HEMATOLOGY\nHGB {hgb} g/dL\n')
+            results, _ = document_ocr.reparse_stored_ocr(source, processes=1)
+            self.assertEqual({result['source_file']: result['testResults'][0]['result'] for result in results},
+                             {'report.txt': '14.2', 'sub/report.txt': '9.8'})
+
+try:
+    fitz = document_ocr.import_pymupdf()
+except ImportError:
+    fitz = None
+
+@unittest.skipIf(fitz is None, 'PyMuPDF is not installed')
+class PdfMinimizerPageDropTest(unittest.TestCase):
+    def build_pdf(self, page_texts):
+        with fitz.open() as doc:
+            for text in page_texts:
+                page = doc.new_page()
+                if text:
+                    page.insert_text((72, 72), text, fontsize=10)
+            return doc.tobytes()
+
+    def droppable_pages(self, page_texts):
+        with fitz.open(stream=self.build_pdf(page_texts), filetype='pdf') as doc:
+            return document_ocr.PdfMinimizer()._droppable_pages(doc, fitz)
+
+    def test_sparse_text_page_is_kept(self):
+        self.assertEqual(self.droppable_pages(['CBC\nWBC 6.8 10^9/L (3.5-10.0)', 'HGB 14.2 g/dL']), [])
+
+    def test_blank_and_duplicate_pages_are_dropped(self):
+        report = 'CBC\nWBC 6.8 10^9/L (3.5-10.0)'
+        self.assertEqual(self.droppable_pages([report, '', report]), [1, 2])
+
+    def test_pages_differing_by_one_digit_are_kept(self):
+        self.assertEqual(self.droppable_pages(['HGB 14.2 g/dL', 'HGB 14.3 g/dL']), [])
+
+if __name__ == '__main__':
+    unittest.main()